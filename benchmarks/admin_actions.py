@@ -0,0 +1,62 @@
+"""
+Time taken by the ContactMail admin actions run on every row of a large
+table ("select all"), against QuerySet.update() and QuerySet.delete(),
+which loads every instance. The table is filled with 200000 rows, or with
+the number of rows given as argument::
+
+    python -m benchmarks.admin_actions 200000
+"""
+from benchmarks.common import setup
+
+setup()
+
+import datetime
+import time
+from optparse import OptionParser
+
+from django.contrib.auth.models import User
+from django.test.client import Client
+
+from benchmarks.admin_changelist import fill
+from inviteme.models import ContactMail
+
+
+def timed(label, func):
+    start = time.time()
+    func()
+    print "%-40s %10.2f seconds" % (label, time.time() - start)
+
+
+def run_action(client, action, **data):
+    data.update({"action": action, "select_across": "1", "index": "0",
+                 "_selected_action": [ContactMail.objects.all()[0].pk]})
+    response = client.post("/admin/inviteme/contactmail/", data)
+    assert response.status_code in (200, 302), response.status_code
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="python -m benchmarks.admin_actions [rows]")
+    options, args = parser.parse_args()
+    if len(args) > 1:
+        parser.error("too many arguments")
+    try:
+        rows = args and int(args[0]) or 200000
+    except ValueError:
+        parser.error("rows must be a number, not %r" % args[0])
+    User.objects.create_superuser("admin", "admin@example.com", "admin")
+    client = Client()
+    client.login(username="admin", password="admin")
+
+    fill(rows)
+    timed("QuerySet.update()", lambda: ContactMail.objects.update(
+            invited_date=datetime.datetime.now()))
+    ContactMail.objects.update(invited_date=None)
+    timed("mark_invited action",
+          lambda: run_action(client, "mark_invited"))
+    timed("QuerySet.delete()", lambda: ContactMail.objects.all().delete())
+    fill(rows)
+    timed("delete_in_chunks action, confirmation",
+          lambda: run_action(client, "delete_in_chunks"))
+    timed("delete_in_chunks action",
+          lambda: run_action(client, "delete_in_chunks", post="yes"))
+    assert not ContactMail.objects.exists()
@@ -0,0 +1,63 @@
+"""
+Latency of the ContactMail admin changelist on a large table, counting the
+rows with COUNT(*) and with the estimated count. The table is filled with
+a million rows, or with the number of rows given as argument::
+
+    python -m benchmarks.admin_changelist 1000000
+"""
+from benchmarks.common import setup, bench
+
+setup()
+
+import datetime
+from optparse import OptionParser
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.client import Client
+
+from inviteme.bulk import insert_rows
+from inviteme.models import ContactMail
+from inviteme.paginator import EstimatedCountPaginator
+
+
+def fill(rows, chunk_size=10000):
+    start = datetime.datetime(2012, 1, 1)
+    for offset in xrange(0, rows, chunk_size):
+        insert_rows(ContactMail, ("email", "site_id", "submit_date",
+                                  "admin_notified"),
+                    [("user%07d@example.com" % i, 1,
+                      start + datetime.timedelta(seconds=i * 30), True)
+                     for i in xrange(offset, min(rows, offset + chunk_size))])
+    connection.cursor().execute("ANALYZE")
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="python -m benchmarks.admin_changelist [rows]")
+    options, args = parser.parse_args()
+    if len(args) > 1:
+        parser.error("too many arguments")
+    try:
+        rows = args and int(args[0]) or 1000000
+    except ValueError:
+        parser.error("rows must be a number, not %r" % args[0])
+    fill(rows)
+    User.objects.create_superuser("admin", "admin@example.com", "admin")
+    client = Client()
+    client.login(username="admin", password="admin")
+    url = "/admin/inviteme/contactmail/"
+    print "%d contact mails" % ContactMail.objects.count()
+    for label, threshold in (("COUNT(*)", None), ("estimated count", 0)):
+        EstimatedCountPaginator.threshold = threshold
+        bench("paginator count, %s" % label,
+              lambda: EstimatedCountPaginator(ContactMail.objects.all(),
+                                              100).count,
+              number=5, repeat=2)
+        bench("first page, %s" % label,
+              lambda: client.get(url), number=5, repeat=2)
+        bench("page 1000, %s" % label,
+              lambda: client.get(url + "?p=1000"), number=5, repeat=2)
+        bench("submit_date filter, %s" % label,
+              lambda: client.get(url + "?submit_date__year=2012"
+                                 "&submit_date__month=3"),
+              number=5, repeat=2)
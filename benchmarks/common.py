@@ -0,0 +1,42 @@
+"""
+Helpers shared by the benchmark scripts. Run them from the top directory of
+the repository, i.e.::
+
+    python -m benchmarks.render_email
+"""
+import os
+import sys
+import time
+
+
+def setup(settings_module="benchmarks.settings", database=None):
+    """
+    Configure Django and create the test database. SQLite test databases
+    are kept in memory, where every thread gets its own. Benchmarks with
+    threads give the path of a ``database`` file instead.
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    if database is not None:
+        from django.conf import settings
+        settings.DATABASES["default"]["TEST_NAME"] = database
+    from django.db import connection
+    connection.creation.create_test_db(verbosity=0)
+
+
+def bench(label, func, number=1000, repeat=3):
+    """
+    Call ``func`` ``number`` times, ``repeat`` times, print and return the
+    best time per call in microseconds.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        for j in xrange(number):
+            func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    usec = best * 1e6 / number
+    print "%-40s %10.1f usec/call" % (label, usec)
+    return usec
@@ -0,0 +1,36 @@
+"""
+Cost of visiting a confirmation URL that has already been used, as mail
+scanners do, with and without the cache of used keys.
+"""
+from benchmarks.common import setup, bench
+
+setup()
+
+import datetime
+
+from django.http import Http404
+from django.test.client import RequestFactory
+
+from inviteme import signed, views
+from inviteme.replay import used_keys
+
+
+def confirm(request, key):
+    try:
+        views.confirm_mail(request, key)
+    except Http404:
+        pass
+
+
+if __name__ == "__main__":
+    data = {"email": u"alice.liddell@wonderland.com",
+            "submit_date": datetime.datetime.now()}
+    key = signed.dumps_mail(data, extra_key=views.INVITEME_SALT)
+    request = RequestFactory().get("/confirm/%s" % key)
+    confirm(request, key)
+    ttl = used_keys.ttl
+    used_keys.ttl = 0
+    bench("used key, no cache", lambda: confirm(request, key), number=2000)
+    used_keys.ttl = ttl
+    bench("used key, in process cache", lambda: confirm(request, key),
+          number=2000)
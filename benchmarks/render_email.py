@@ -0,0 +1,46 @@
+"""
+Per email rendering cost of the confirmation and notification messages,
+loading the templates on every message (as before the template cache) and
+with the compiled templates cached.
+"""
+from benchmarks.common import setup, bench
+
+setup()
+
+import datetime
+
+from django.contrib.sites.models import Site
+from django.core.urlresolvers import reverse
+from django.template import Context, loader
+
+from inviteme import views
+from inviteme.utils import get_template, mail_dispatcher
+
+
+DATA = {"email": "alice@example.com",
+        "submit_date": datetime.datetime.now()}
+
+
+def render(get_template):
+    site = Site.objects.get_current()
+    context = Context({"data": DATA,
+                       "confirmation_url": reverse("inviteme-confirm-mail",
+                                                   args=["key"]),
+                       "support_email": "support@example.com",
+                       "site": site})
+    get_template("inviteme/confirmation_email.txt").render(context)
+    get_template("inviteme/confirmation_email.html").render(context)
+
+
+def send():
+    views.send_confirmation_email(DATA, "key")
+
+
+if __name__ == "__main__":
+    before = bench("render, templates loaded per email",
+                   lambda: render(loader.get_template))
+    after = bench("render, templates cached",
+                  lambda: render(get_template))
+    print "%-40s %10.1fx" % ("speedup", before / after)
+    bench("send_confirmation_email", send)
+    mail_dispatcher.join()
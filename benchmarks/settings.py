@@ -0,0 +1,21 @@
+# Settings for the benchmarks: the test settings without debugging, which
+# would otherwise disable caches and keep every SQL query in memory.
+from inviteme.tests.settings import *
+
+DEBUG = False
+TEMPLATE_DEBUG = False
+
+EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.admin',
+] + INSTALLED_APPS
+
+MIDDLEWARE_CLASSES = MIDDLEWARE_CLASSES + (
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+)
+
+ROOT_URLCONF = 'benchmarks.urls'
@@ -0,0 +1,52 @@
+"""
+Throughput and length of the confirmation tokens: pickle based dumps() and
+loads() against the compact dumps_mail() and loads_mail(). Also the cost of
+an HMAC with a fresh key against the cached, pre-keyed HMAC objects.
+"""
+from benchmarks.common import setup, bench
+
+setup()
+
+import datetime
+import hmac
+
+from django.conf import settings
+from django.utils import crypto
+from django.utils.hashcompat import sha_constructor
+
+from inviteme import signed
+
+
+DATA = {"email": u"alice.liddell@wonderland.com",
+        "submit_date": datetime.datetime.now()}
+SALT = "es-war-einmal"
+
+
+if __name__ == "__main__":
+    pickled = signed.dumps(DATA, compress=True, extra_key=SALT)
+    compact = signed.dumps_mail(DATA, extra_key=SALT)
+    print "%-40s %10d chars" % ("pickle token length", len(pickled))
+    print "%-40s %10d chars" % ("compact token length", len(compact))
+    bench("dumps (pickle + zlib)",
+          lambda: signed.dumps(DATA, compress=True, extra_key=SALT),
+          number=10000)
+    bench("dumps_mail (compact)",
+          lambda: signed.dumps_mail(DATA, extra_key=SALT), number=10000)
+    bench("loads (pickle + zlib)",
+          lambda: signed.loads(pickled, extra_key=SALT), number=10000)
+    bench("loads_mail (compact)",
+          lambda: signed.loads_mail(compact, extra_key=SALT), number=10000)
+
+    key = settings.SECRET_KEY + SALT
+    bench("base64_hmac, keyed per call",
+          lambda: signed.encode(hmac.new(key, compact,
+                                         sha_constructor).digest()),
+          number=10000)
+    bench("base64_hmac, cached key",
+          lambda: signed.base64_hmac(compact, key), number=10000)
+    bench("form security hash, django salted_hmac",
+          lambda: crypto.salted_hmac(SALT, "1327942345").hexdigest(),
+          number=10000)
+    bench("form security hash, cached salted_hmac",
+          lambda: signed.salted_hmac(SALT, "1327942345").hexdigest(),
+          number=10000)
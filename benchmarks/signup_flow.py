@@ -0,0 +1,213 @@
+"""
+Load test of the whole signup flow: get_form, post_form and confirm_mail
+driven through the Django test client by a number of concurrent threads,
+with the locmem mail backend and a SQLite database file.
+
+It reports the latency percentiles of each view and of the stages within
+them (security hash, token signing, template rendering, database and mail
+handoff) and the signups per second. Results can be saved as JSON and
+compared with the ones of another commit::
+
+    python -m benchmarks.signup_flow --concurrency 4 --signups 2000 \\
+        --json before.json
+    git checkout other-branch
+    python -m benchmarks.signup_flow --concurrency 4 --signups 2000 \\
+        --compare before.json
+
+Rate limits and the dedupe window are disabled, every signup uses a
+different address.
+"""
+import os
+import tempfile
+
+from benchmarks.common import setup
+
+DATABASE = tempfile.mktemp(suffix=".sqlite3")
+setup(database=DATABASE)
+
+import re
+import subprocess
+import threading
+import time
+from optparse import OptionParser
+
+from django.test.client import Client
+from django.utils import simplejson
+
+from inviteme import signed, utils, views
+from inviteme.dedupe import recent_requests
+from inviteme.forms import ContactMailSecurityForm
+from inviteme.models import ContactMailManager
+
+
+PERCENTILES = (50, 90, 99)
+
+FORM_RE = re.compile(r'name="(timestamp|security_hash)" value="([^"]+)"')
+
+
+class Timings(object):
+    """Thread safe lists of the seconds taken by each timed stage."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.times = {}
+
+    def add(self, stage, seconds):
+        self.lock.acquire()
+        try:
+            self.times.setdefault(stage, []).append(seconds)
+        finally:
+            self.lock.release()
+
+    def timed(self, obj, name, stage, on_result=None):
+        """Replace the function ``name`` of ``obj`` by one timing it."""
+        func = getattr(obj, name)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            result = func(*args, **kwargs)
+            self.add(stage, time.time() - start)
+            if on_result is not None:
+                on_result(args, result)
+            return result
+        setattr(obj, name, wrapper)
+
+
+def percentile(values, percent):
+    # nearest rank
+    index = max(0, int(round(len(values) * percent / 100.0)) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def summary(values):
+    values = sorted(values)
+    result = {"count": len(values), "max": values[-1] * 1e3,
+              "mean": sum(values) / len(values) * 1e3}
+    for percent in PERCENTILES:
+        result["p%d" % percent] = percentile(values, percent) * 1e3
+    return result
+
+
+def instrument(timings, keys):
+    """Time the stages of the views, and keep the key sent to each email."""
+    def keep_key(args, key):
+        keys[args[0]["email"]] = key
+
+    timings.timed(ContactMailSecurityForm, "generate_security_hash",
+                  "stage: security hash")
+    timings.timed(signed, "dumps_mail", "stage: sign token", keep_key)
+    timings.timed(signed, "loads_mail", "stage: verify token")
+    timings.timed(utils, "render_mail", "stage: render mail")
+    timings.timed(utils, "send_message", "stage: mail handoff")
+    timings.timed(ContactMailManager, "create_unique", "stage: db insert")
+
+
+def signup(client, timings, keys, email):
+    start = time.time()
+    response = client.get("/invite/")
+    timings.add("view: get_form", time.time() - start)
+    data = dict(FORM_RE.findall(response.content))
+    data["email"] = email
+
+    start = time.time()
+    response = client.post("/invite/post/", data)
+    timings.add("view: post_form", time.time() - start)
+    assert response.status_code == 200, response.status_code
+
+    start = time.time()
+    response = client.get("/invite/confirm/%s" % keys[email])
+    timings.add("view: confirm_mail", time.time() - start)
+    assert response.status_code == 200, response.status_code
+
+
+def run(concurrency, signups):
+    timings = Timings()
+    keys = {}
+    instrument(timings, keys)
+    views.ip_rate_limit = views.email_rate_limit = None
+    recent_requests.window = 0
+    errors = []
+
+    def worker(index):
+        client = Client()
+        try:
+            for i in xrange(index, signups, concurrency):
+                signup(client, timings, keys, "user%07d@example.com" % i)
+        except Exception, e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(index,))
+               for index in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    utils.mail_dispatcher.join()
+    if errors:
+        raise errors[0]
+    return {"commit": git_commit(),
+            "concurrency": concurrency,
+            "signups": signups,
+            "signups_per_second": signups / elapsed,
+            "latency_ms": dict((stage, summary(values))
+                               for stage, values in timings.times.items())}
+
+
+def git_commit():
+    try:
+        return subprocess.Popen(["git", "rev-parse", "--short", "HEAD"],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE).communicate()[0].strip()
+    except OSError:
+        return None
+
+
+def report(results, baseline=None):
+    def delta(new, old):
+        if not old:
+            return ""
+        return "%+7.1f%%" % ((new - old) * 100.0 / old)
+
+    print "commit %s, %d threads, %d signups" % (
+        results["commit"], results["concurrency"], results["signups"])
+    old = baseline and baseline["signups_per_second"]
+    print "%-24s %8.1f signups/sec %s" % (
+        "throughput", results["signups_per_second"],
+        delta(results["signups_per_second"], old))
+    columns = ["p%d" % percent for percent in PERCENTILES] + ["max"]
+    print "%-24s %8s " % ("latency (ms)", "count") + " ".join(
+        ["%8s" % column for column in columns])
+    for stage in sorted(results["latency_ms"]):
+        stats = results["latency_ms"][stage]
+        line = "%-24s %8d " % (stage, stats["count"]) + " ".join(
+            ["%8.2f" % stats[column] for column in columns])
+        if baseline and stage in baseline["latency_ms"]:
+            line += "   p50 %s" % delta(stats["p50"],
+                                       baseline["latency_ms"][stage]["p50"])
+        print line
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="python -m benchmarks.signup_flow [options]")
+    parser.add_option("--concurrency", type="int", default=4,
+                      help="Threads signing up at once (default: 4).")
+    parser.add_option("--signups", type="int", default=1000,
+                      help="Total number of signups (default: 1000).")
+    parser.add_option("--json", dest="json_path",
+                      help="Write the results to this JSON file.")
+    parser.add_option("--compare", dest="baseline_path",
+                      help="Compare with the results in this JSON file.")
+    options, args = parser.parse_args()
+    try:
+        results = run(options.concurrency, options.signups)
+    finally:
+        os.remove(DATABASE)
+    baseline = None
+    if options.baseline_path:
+        baseline = simplejson.load(open(options.baseline_path))
+    report(results, baseline)
+    if options.json_path:
+        output = open(options.json_path, "w")
+        simplejson.dump(results, output, indent=2, sort_keys=True)
+        output.close()
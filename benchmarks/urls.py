@@ -0,0 +1,9 @@
+from django.conf.urls.defaults import patterns, include
+from django.contrib import admin
+
+admin.autodiscover()
+
+urlpatterns = patterns('',
+    (r'^invite/', include('inviteme.urls')),
+    (r'^admin/', include(admin.site.urls)),
+)
@@ -1,15 +1,225 @@
+import datetime
+import logging
+import time
+
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.http import HttpResponse
+from django.shortcuts import render_to_response
+from django.template import RequestContext
 from django.utils.translation import ugettext_lazy as _
 
-from inviteme.models import ContactMail
+from inviteme.bulk import delete_rows, export_contact_mails, update_rows
+from inviteme.invitations import INVITEME_INVITATION_RATE, send_invitations
+from inviteme.models import ContactMail, OutboxMail
+from inviteme.paginator import EstimatedCountPaginator
+
+
+INVITEME_ADMIN_CHUNK_SIZE = getattr(settings, "INVITEME_ADMIN_CHUNK_SIZE",
+                                    1000)
+INVITEME_ADMIN_INVITE_LIMIT = getattr(settings, "INVITEME_ADMIN_INVITE_LIMIT",
+                                      100)
+
+logger = logging.getLogger("inviteme.admin")
+
+
+def stream_export(queryset, format):
+    """
+    Yield the export of ``queryset`` and close the database connection once
+    done. The rows are read while the response is being sent, after
+    ``request_finished`` has closed the connection of the request, so the
+    one opened to read them would be left open otherwise.
+    """
+    try:
+        for data in export_contact_mails(queryset, format):
+            yield data
+    finally:
+        connections[queryset.db].close()
+
+
+def export_response(queryset, format, mimetype):
+    # The response content is a generator, rows are read from the database
+    # in chunks while the response is being sent.
+    response = HttpResponse(stream_export(queryset, format),
+                            mimetype=mimetype)
+    response["Content-Disposition"] = ("attachment; filename=contact_mails.%s"
+                                       % format)
+    return response
+
+
+def export_csv(modeladmin, request, queryset):
+    return export_response(queryset, "csv", "text/csv")
+export_csv.short_description = _("Export selected contact mails as CSV")
+
+
+def export_jsonl(modeladmin, request, queryset):
+    return export_response(queryset, "jsonl", "application/x-json-stream")
+export_jsonl.short_description = _("Export selected contact mails as JSON lines")
+
+
+def send_invitations_action(modeladmin, request, queryset):
+    """
+    Invite the selected mails, within the request. Larger selections than
+    ``INVITEME_ADMIN_INVITE_LIMIT`` are left for the
+    ``inviteme_send_invitations`` command.
+    """
+    queryset = queryset.filter(invited_date__isnull=True)
+    pending = queryset.values_list("pk", flat=True)
+    if len(pending[:INVITEME_ADMIN_INVITE_LIMIT + 1]) > \
+            INVITEME_ADMIN_INVITE_LIMIT:
+        modeladmin.message_user(request, _(
+                "More than %d contact mails to invite, use the "
+                "inviteme_send_invitations management command.")
+                                % INVITEME_ADMIN_INVITE_LIMIT)
+        return
+    sent = send_invitations(queryset, INVITEME_ADMIN_CHUNK_SIZE,
+                            INVITEME_INVITATION_RATE)
+    modeladmin.message_user(request, _("%d invitations sent.") % sent)
+send_invitations_action.short_description = _("Invite selected contact mails")
+
+
+def log_progress(action):
+    def progress(done):
+        logger.info("%s: %d contact mails done", action, done)
+    return progress
+
+
+def done_message(count, start):
+    return _("%(count)d contact mails in %(seconds).1f seconds.") % {
+        "count": count, "seconds": time.time() - start}
+
+
+def mark_invited(modeladmin, request, queryset):
+    start = time.time()
+    updated = update_rows(queryset.filter(invited_date__isnull=True),
+                          {"invited_date": datetime.datetime.now()},
+                          INVITEME_ADMIN_CHUNK_SIZE,
+                          progress=log_progress("mark_invited"))
+    modeladmin.message_user(request, _("Marked as invited: %s") %
+                            done_message(updated, start))
+mark_invited.short_description = _("Mark selected contact mails as invited")
+
+
+def delete_in_chunks(modeladmin, request, queryset):
+    """
+    Replaces the ``delete_selected`` action, which loads every selected
+    object to list them in the confirmation page and to delete them. The
+    confirmation page only shows how many there are, and rows are deleted
+    ``INVITEME_ADMIN_CHUNK_SIZE`` at a time (see ``inviteme.bulk``).
+    """
+    if not modeladmin.has_delete_permission(request):
+        raise PermissionDenied
+    count = EstimatedCountPaginator(queryset, 1).count
+    if not request.POST.get("post"):
+        return render_to_response("inviteme/admin/delete_confirmation.html", {
+                "title": _("Are you sure?"),
+                "opts": modeladmin.model._meta,
+                "count": count,
+                "chunk_size": INVITEME_ADMIN_CHUNK_SIZE,
+                "selected": request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+                "select_across": request.POST.get("select_across", "0"),
+                "action_checkbox_name": helpers.ACTION_CHECKBOX_NAME,
+                }, context_instance=RequestContext(request))
+    start = time.time()
+    deleted = delete_rows(queryset, INVITEME_ADMIN_CHUNK_SIZE,
+                          progress=log_progress("delete"))
+    modeladmin.message_user(request, _("Deleted: %s") %
+                            done_message(deleted, start))
+delete_in_chunks.short_description = _("Delete selected contact mails")
+
+
+def date_range_params(params, field_name):
+    """
+    Replace the ``__year``, ``__month`` and ``__day`` lookups that the date
+    hierarchy adds to ``params`` with the equivalent ``__gte`` and ``__lt``
+    lookups, which, unlike date part extraction, can use an index.
+    """
+    lookups = ["%s__%s" % (field_name, part) for part in ("year", "month", "day")]
+    year, month, day = [params.get(lookup) for lookup in lookups]
+    try:
+        if month is None:
+            start = datetime.date(int(year), 1, 1)
+            end = start.replace(year=start.year + 1)
+        elif day is None:
+            start = datetime.date(int(year), int(month), 1)
+            end = (start + datetime.timedelta(days=31)).replace(day=1)
+        else:
+            start = datetime.date(int(year), int(month), int(day))
+            end = start + datetime.timedelta(days=1)
+    except (TypeError, ValueError):
+        return params
+    params = params.copy()
+    for lookup in lookups:
+        params.pop(lookup, None)
+    params["%s__gte" % field_name] = start
+    params["%s__lt" % field_name] = end
+    return params
+
+
+class EstimatedCountChangeList(ChangeList):
+
+    def get_query_set(self):
+        if not self.date_hierarchy:
+            return super(EstimatedCountChangeList, self).get_query_set()
+        # The date hierarchy template tag still reads the original params.
+        params = self.params
+        self.params = date_range_params(params, self.date_hierarchy)
+        try:
+            return super(EstimatedCountChangeList, self).get_query_set()
+        finally:
+            self.params = params
+
+    def get_results(self, request):
+        # With filters applied ChangeList also counts the whole table, to
+        # show the total. Let that count be estimated as well.
+        root_query_set = self.root_query_set
+        self.root_query_set = root_query_set._clone()
+        self.root_query_set.count = lambda: self.model_admin.paginator(
+            root_query_set, self.list_per_page).count
+        try:
+            super(EstimatedCountChangeList, self).get_results(request)
+        finally:
+            self.root_query_set = root_query_set
+
 
 class ContactMailAdmin(admin.ModelAdmin):
-    list_display = ('email', 'ip_address', 'submit_date')
+    list_display = ('email', 'site', 'ip_address', 'submit_date',
+                    'invited_date')
+    list_filter = ('site',)
+    list_select_related = True
+    paginator = EstimatedCountPaginator
     fieldsets = (
         (None,          {'fields': ('site',)}),
         (_('Content'),  {'fields': ('email','submit_date', 'ip_address')}),
+        (_('Invitation'), {'fields': ('invited_date',)}),
     )
     date_hierarchy = 'submit_date'
     ordering = ('-submit_date',)
+    actions = [export_csv, export_jsonl, send_invitations_action,
+               mark_invited, delete_in_chunks]
+
+    def get_actions(self, request):
+        actions = super(ContactMailAdmin, self).get_actions(request)
+        actions.pop("delete_selected", None)
+        if not self.has_delete_permission(request):
+            actions.pop("delete_in_chunks", None)
+        return actions
+
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
 
 admin.site.register(ContactMail, ContactMailAdmin)
+
+
+class OutboxMailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipients', 'status', 'attempts', 'created',
+                    'sent_date')
+    list_filter = ('status',)
+    search_fields = ('recipients',)
+    date_hierarchy = 'created'
+
+admin.site.register(OutboxMail, OutboxMailAdmin)
@@ -0,0 +1,190 @@
+"""
+Helpers to work with large numbers of ``ContactMail`` rows in constant
+memory, a chunk of rows at a time.
+"""
+
+import csv
+import datetime
+import time
+from StringIO import StringIO
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+
+EXPORT_FIELDS = ("email", "site_id", "submit_date", "ip_address")
+
+EXPORT_FORMATS = ("csv", "jsonl")
+
+# Field types whose values are passed as they are to the database adapter.
+RAW_FIELD_TYPES = ("AutoField", "CharField", "EmailField", "ForeignKey",
+                   "IntegerField", "IPAddressField", "PositiveIntegerField",
+                   "TextField")
+
+
+def iter_chunks(queryset, fields, chunk_size=1000):
+    """
+    Yield lists of at most ``chunk_size`` tuples with the values of
+    ``fields`` of the rows in ``queryset``.
+
+    Rows are read in primary key order, and each chunk is a new query
+    starting after the last key of the previous chunk. Unlike slicing with
+    offsets, every query uses the primary key index, however deep in the
+    table it reads.
+    """
+    queryset = queryset.order_by("pk").values_list("pk", *fields)
+    last_pk = None
+    while True:
+        chunk_qs = queryset
+        if last_pk is not None:
+            chunk_qs = queryset.filter(pk__gt=last_pk)
+        rows = list(chunk_qs[:chunk_size])
+        if not rows:
+            return
+        last_pk = rows[-1][0]
+        yield [row[1:] for row in rows]
+        if len(rows) < chunk_size:
+            return
+
+
+def iter_pk_chunks(queryset, chunk_size=1000):
+    """
+    Yield lists of at most ``chunk_size`` primary keys of the rows in
+    ``queryset``, in order. See ``iter_chunks``.
+    """
+    pk_name = queryset.model._meta.pk.attname
+    for rows in iter_chunks(queryset, (pk_name,), chunk_size):
+        yield [row[0] for row in rows]
+
+
+def _for_each_chunk(queryset, func, chunk_size, sleep, progress):
+    # Calls func with every chunk of primary keys, in its own transaction so
+    # that locks are held for one chunk only. Returns the sum of its results.
+    func = transaction.commit_on_success(using=queryset.db)(func)
+    done = 0
+    for index, pks in enumerate(iter_pk_chunks(queryset, chunk_size)):
+        if index and sleep:
+            time.sleep(sleep)
+        done += func(pks)
+        if progress is not None:
+            progress(done)
+    return done
+
+
+def update_rows(queryset, values, chunk_size=1000, sleep=0, progress=None):
+    """
+    Set the fields in the dict ``values`` of the rows in ``queryset``, with
+    an ``UPDATE`` of the primary key range of each chunk of ``chunk_size``
+    rows, sleeping ``sleep`` seconds between chunks. ``progress``, if given,
+    is called with the number of rows updated after every chunk. Returns
+    the number of rows updated.
+    """
+    def update(pks):
+        return queryset.filter(pk__gte=pks[0], pk__lte=pks[-1]).update(
+            **values)
+    return _for_each_chunk(queryset, update, chunk_size, sleep, progress)
+
+
+def delete_rows(queryset, chunk_size=1000, sleep=0, progress=None):
+    """
+    Delete the rows in ``queryset`` with a ``DELETE`` of the primary keys of
+    each chunk of ``chunk_size`` rows, sleeping ``sleep`` seconds between
+    chunks. ``progress``, if given, is called with the number of rows
+    deleted after every chunk. Returns the number of rows deleted.
+
+    Unlike ``QuerySet.delete``, instances are not loaded, signals are not
+    sent and related rows are not deleted: it is only for tables no other
+    table refers to, like the one of ``ContactMail``.
+    """
+    connection = connections[queryset.db]
+    qn = connection.ops.quote_name
+    opts = queryset.model._meta
+    sql = "DELETE FROM %s WHERE %s IN (%%s)" % (qn(opts.db_table),
+                                               qn(opts.pk.column))
+    def delete(pks):
+        cursor = connection.cursor()
+        cursor.execute(sql % ", ".join(["%s"] * len(pks)), pks)
+        transaction.set_dirty(using=queryset.db)
+        return cursor.rowcount
+    return _for_each_chunk(queryset, delete, chunk_size, sleep, progress)
+
+
+def _encode(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return unicode(value).encode("utf-8")
+
+
+def export_csv(chunks, fields=EXPORT_FIELDS):
+    """Yield a CSV string, with a header line, for every chunk of rows."""
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(fields)
+    for rows in chunks:
+        writer.writerows([[_encode(value) for value in row] for row in rows])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def export_jsonl(chunks, fields=EXPORT_FIELDS):
+    """Yield a string with one JSON object per line for every chunk of rows."""
+    encoder = DjangoJSONEncoder()
+    for rows in chunks:
+        yield "".join([encoder.encode(dict(zip(fields, row))) + "\n"
+                       for row in rows])
+
+
+def export_contact_mails(queryset, format="csv", chunk_size=1000):
+    """
+    Yield the ``ContactMail`` rows of ``queryset`` as strings in the given
+    ``format``, one of ``EXPORT_FORMATS``.
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError("Unknown export format: %r" % format)
+    chunks = iter_chunks(queryset, EXPORT_FIELDS, chunk_size)
+    if format == "csv":
+        return export_csv(chunks)
+    return export_jsonl(chunks)
+
+
+def insert_rows(model, fields, rows, using=DEFAULT_DB_ALIAS):
+    """
+    Insert ``rows``, tuples with the values of ``fields`` (attribute names,
+    like ``site_id``), in the table of
+    ``model`` with a single ``executemany`` in its own transaction. Values
+    are prepared for the database by the model fields, but neither ``save``
+    nor signals are called.
+    """
+    if not rows:
+        return 0
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    by_attname = dict((field.attname, field) for field in model._meta.fields)
+    model_fields = [by_attname[name] for name in fields]
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        qn(model._meta.db_table),
+        ", ".join([qn(field.column) for field in model_fields]),
+        ", ".join(["%s"] * len(model_fields)))
+    # Text and integer values need no conversion, only the rest of the
+    # columns go through get_db_prep_save, which is slow for large inserts.
+    prepared = [index for index, field in enumerate(model_fields)
+                if field.get_internal_type() not in RAW_FIELD_TYPES]
+    params = []
+    for row in rows:
+        row = list(row)
+        for index in prepared:
+            row[index] = model_fields[index].get_db_prep_save(
+                row[index], connection=connection)
+        params.append(row)
+
+    @transaction.commit_on_success(using=using)
+    def insert():
+        connection.cursor().executemany(sql, params)
+        transaction.set_dirty(using=using)
+    insert()
+    return len(rows)
@@ -0,0 +1,124 @@
+"""
+Stores for the short lived values kept by django-inviteme, like the
+confirmation keys already used.
+
+A store is either a Django cache, to share the values between processes, or
+an ``LRUCache``, which keeps them in the memory of the process and does not
+need any cache to be configured.
+"""
+
+import threading
+import time
+
+from django.core.cache import get_cache
+from django.core.cache.backends.dummy import DummyCache
+
+try:
+    from collections import OrderedDict
+except ImportError: # Python < 2.7, pop() is slower
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+
+class LRUCache(object):
+    """
+    Thread safe, in process cache with the part of the Django cache API
+    used by django-inviteme: ``get``, ``set``, ``add``, ``incr``, ``delete``
+    and ``clear``. It holds at most ``max_entries`` keys, evicting the least
+    recently used first. Expired keys are dropped when they are read.
+    """
+
+    def __init__(self, max_entries=10000, default_timeout=300):
+        self.max_entries = max_entries
+        self.default_timeout = default_timeout
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def _get(self, key, now):
+        # Must be called with the lock held. Moves key to the most recently
+        # used end and returns its (value, expires) or None.
+        entry = self._data.pop(key, None)
+        if entry is None or entry[1] <= now:
+            return None
+        self._data[key] = entry
+        return entry
+
+    def _set(self, key, value, timeout, now):
+        if timeout is None:
+            timeout = self.default_timeout
+        self._data.pop(key, None)
+        self._data[key] = (value, now + timeout)
+        while len(self._data) > self.max_entries:
+            del self._data[iter(self._data).next()]
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            entry = self._get(key, time.time())
+        finally:
+            self._lock.release()
+        if entry is None:
+            return default
+        return entry[0]
+
+    def set(self, key, value, timeout=None):
+        self._lock.acquire()
+        try:
+            self._set(key, value, timeout, time.time())
+        finally:
+            self._lock.release()
+
+    def add(self, key, value, timeout=None):
+        """Set ``key`` only if it is not in the cache. Returns True if set."""
+        now = time.time()
+        self._lock.acquire()
+        try:
+            if self._get(key, now) is not None:
+                return False
+            self._set(key, value, timeout, now)
+            return True
+        finally:
+            self._lock.release()
+
+    def incr(self, key, delta=1):
+        """
+        Add ``delta`` to the value of ``key``, keeping its expiration time.
+        Raises ValueError if the key is not in the cache.
+        """
+        self._lock.acquire()
+        try:
+            entry = self._get(key, time.time())
+            if entry is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = entry[0] + delta
+            self._data[key] = (value, entry[1])
+            return value
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            self._data.pop(key, None)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._data = OrderedDict()
+        finally:
+            self._lock.release()
+
+
+def get_store(backend=None, max_entries=10000):
+    """
+    Return the Django cache ``backend``, a ``CACHES`` alias or a backend
+    URI as accepted by ``get_cache``, or a new ``LRUCache`` of
+    ``max_entries`` keys if ``backend`` is None or a dummy cache, which
+    would not keep anything.
+    """
+    if backend is not None:
+        cache = get_cache(backend)
+        if not isinstance(cache, DummyCache):
+            return cache
+    return LRUCache(max_entries)
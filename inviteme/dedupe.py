@@ -0,0 +1,52 @@
+"""
+Addresses whose confirmation has been requested recently.
+
+Users double click the post button or post the form again when the message
+takes long to arrive. Posts for an address whose confirmation message was
+sent less than ``INVITEME_DEDUPE_WINDOW`` seconds ago get the same response
+as the first one, but no new message is sent.
+"""
+
+from django.conf import settings
+from django.utils.hashcompat import md5_constructor
+
+from inviteme.cache import get_store
+
+
+INVITEME_DEDUPE_WINDOW = getattr(settings, "INVITEME_DEDUPE_WINDOW", 60)
+INVITEME_DEDUPE_CACHE = getattr(settings, "INVITEME_DEDUPE_CACHE", "default")
+
+
+class RecentRequests(object):
+    """
+    Addresses requested in the last ``window`` seconds, kept in ``store``
+    (see ``inviteme.cache``).
+    """
+
+    def __init__(self, store, window):
+        self.store = store
+        self.window = window
+
+    def cache_key(self, email, site_id):
+        # Addresses may be too long or have characters memcached refuses
+        # in keys.
+        digest = md5_constructor(email.lower().encode("utf-8")).hexdigest()
+        return "inviteme:requested:%s:%s" % (site_id, digest)
+
+    def add(self, email, site_id):
+        """
+        Remember ``email`` in the site ``site_id``. Returns False if it was
+        requested already within the window, with ``add`` being atomic in
+        the cache so that only one of concurrent requests gets True.
+        """
+        if not self.window:
+            return True
+        return self.store.add(self.cache_key(email, site_id), 1, self.window)
+
+    def discard(self, email, site_id):
+        if self.window:
+            self.store.delete(self.cache_key(email, site_id))
+
+
+recent_requests = RecentRequests(get_store(INVITEME_DEDUPE_CACHE),
+                                 INVITEME_DEDUPE_WINDOW)
@@ -7,9 +7,12 @@ import datetime
 
 from django import forms
 from django.forms.util import ErrorDict
-from django.utils.crypto import salted_hmac, constant_time_compare
+from django.utils.crypto import constant_time_compare
 from django.utils.translation import ugettext_lazy as _
 
+from inviteme import signed
+from inviteme.normalize import is_blocked, normalize_email
+
 
 class ContactMailSecurityForm(forms.Form):
     """
@@ -41,13 +44,14 @@ class ContactMailSecurityForm(forms.Form):
         return ts
 
     def clean_security_hash(self):
-        """Check the security hash."""
+        """Check the security hash, with the current and the old secrets."""
         timestamp = self.data.get("timestamp", "")
-        expected_hash = self.generate_security_hash(timestamp)
         actual_hash = self.cleaned_data["security_hash"]
-        if not constant_time_compare(expected_hash, actual_hash):
-            raise forms.ValidationError("Security hash check failed.")
-        return actual_hash
+        for secret in signed.secret_keys():
+            expected_hash = self.generate_security_hash(timestamp, secret)
+            if constant_time_compare(expected_hash, actual_hash):
+                return actual_hash
+        raise forms.ValidationError("Security hash check failed.")
 
     def clean_honeypot(self):
         """Check that nothing's been entered into the honeypot."""
@@ -65,10 +69,10 @@ class ContactMailSecurityForm(forms.Form):
         }
         return security_dict
 
-    def generate_security_hash(self, timestamp):
+    def generate_security_hash(self, timestamp, secret=None):
         """Generate a HMAC security hash from the timestamp."""
         key_salt = "Es war einmal una princesa que vivia in a beautiful castle"
-        return salted_hmac(key_salt, str(timestamp)).hexdigest()
+        return signed.salted_hmac(key_salt, str(timestamp), secret).hexdigest()
 
 
 class ContactMailForm(ContactMailSecurityForm):
@@ -78,6 +82,19 @@ class ContactMailForm(ContactMailSecurityForm):
                                                            "placeholder":"Email"}),
                              help_text=_("Required for verification"))
 
+    def clean_email(self):
+        """
+        Normalise the address and refuse the ones of blocked domains. See
+        ``inviteme.normalize``.
+        """
+        try:
+            email = normalize_email(self.cleaned_data["email"])
+        except ValueError:
+            raise forms.ValidationError(self.fields["email"].error_messages["invalid"])
+        if is_blocked(email):
+            raise forms.ValidationError(_("Addresses of this domain are not accepted."))
+        return email
+
     def get_instance_data(self):
         """Returns the dict of data to be used to create a contact message."""
         return dict(
@@ -0,0 +1,136 @@
+"""
+Invitations sent to the confirmed addresses, by the
+``inviteme_send_invitations`` management command and the admin action.
+
+Rows without ``invited_date`` are read in primary key chunks (see
+``inviteme.bulk.iter_chunks``). Invitations are sent synchronously, through
+one connection to the mail backend, and a row is marked as invited only
+once the backend has accepted its message, so that sending again after a
+failure resumes where it stopped. If the process dies, the messages sent
+since the last chunk was marked are sent again. With
+``INVITEME_MAIL_OUTBOX`` on, the messages of a chunk are queued in the
+outbox in the same transaction that marks its rows, and the outbox takes
+care of retrying them: every address is invited exactly once.
+"""
+
+import datetime
+import time
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.mail import get_connection
+from django.db import transaction
+from django.template import Context
+from django.utils.translation import ugettext as _
+
+from inviteme import utils
+from inviteme.bulk import iter_chunks
+from inviteme.metrics import mail_metrics
+from inviteme.models import ContactMail, OutboxMail
+
+
+INVITEME_INVITATION_RATE = getattr(settings, "INVITEME_INVITATION_RATE", 10)
+
+
+class Throttle(object):
+    """Make ``wait`` return at most ``rate`` times per second."""
+
+    def __init__(self, rate, clock=time.time, sleep=time.sleep):
+        self.interval = rate and 1.0 / rate or 0
+        self.clock = clock
+        self.sleep = sleep
+        self.next = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = self.clock()
+        if self.next > now:
+            self.sleep(self.next - now)
+            now = self.next
+        self.next = now + self.interval
+
+
+def render_invitation(email, site, template="inviteme/invitation_email.txt",
+                       html_template=None):
+    """Return the invitation message to ``email``, of ``site``."""
+    subject = "[%s] %s" % (site.name, _("your invitation"))
+    message_context = Context({'email': email, 'site': site,
+                               'scheme': utils.INVITEME_URL_SCHEME})
+    return utils.render_mail(subject, template, message_context,
+                             settings.DEFAULT_FROM_EMAIL, [email],
+                             html_template)
+
+
+@transaction.commit_on_success
+def mark_invited(pks):
+    if pks:
+        ContactMail.objects.filter(pk__in=pks).update(
+            invited_date=datetime.datetime.now())
+
+
+def send_invitations(queryset, chunk_size=100, rate=None,
+                     template="inviteme/invitation_email.txt",
+                     html_template=None, progress=None, backend=None):
+    """
+    Invite the addresses of the ``ContactMail`` rows in ``queryset`` not
+    invited yet, at most ``rate`` per second, through a connection to the
+    mail ``backend`` (default: ``EMAIL_BACKEND``). ``progress``, if given,
+    is called with the number of invitations sent after every chunk.
+    Returns the number of invitations sent. Errors of the backend are
+    raised once the invitations already sent are marked.
+    """
+    queryset = queryset.filter(invited_date__isnull=True)
+    throttle = Throttle(rate)
+    sites = {}
+    sent = 0
+    connection = None
+
+    def messages(chunk):
+        for pk, email, site_id in chunk:
+            if site_id not in sites:
+                sites[site_id] = Site.objects.get(pk=site_id)
+            yield pk, render_invitation(email, sites[site_id], template,
+                                        html_template)
+
+    @transaction.commit_on_success
+    def enqueue_chunk(chunk):
+        for pk, message in messages(chunk):
+            OutboxMail.objects.enqueue(message)
+            mail_metrics.incr("queued")
+        mark_invited([row[0] for row in chunk])
+        return len(chunk)
+
+    def send_chunk(chunk):
+        invited = []
+        try:
+            for pk, message in messages(chunk):
+                throttle.wait()
+                try:
+                    accepted = connection.send_messages([message])
+                except Exception:
+                    mail_metrics.incr("failed")
+                    raise
+                if accepted:
+                    mail_metrics.incr("sent")
+                    invited.append(pk)
+        finally:
+            mark_invited(invited)
+        return len(invited)
+
+    if not utils.INVITEME_MAIL_OUTBOX:
+        connection = get_connection(backend)
+        connection.open()
+    try:
+        for chunk in iter_chunks(queryset, ("id", "email", "site_id"),
+                                 chunk_size):
+            if connection is None:
+                sent += enqueue_chunk(chunk)
+            else:
+                sent += send_chunk(chunk)
+            if progress is not None:
+                progress(sent)
+    finally:
+        if connection is not None:
+            connection.close()
+    return sent
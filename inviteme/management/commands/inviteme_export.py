@@ -0,0 +1,67 @@
+import datetime
+import gzip
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+from inviteme.bulk import EXPORT_FORMATS, export_contact_mails
+from inviteme.models import ContactMail
+
+
+def parse_date(value, option):
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise CommandError("%s must be a date as YYYY-MM-DD" % option)
+
+
+class Command(NoArgsCommand):
+    help = ("Export contact mails as CSV or JSON lines, reading them in "
+            "chunks so that memory use does not depend on the table size.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--format", dest="format", default="csv",
+                    choices=EXPORT_FORMATS,
+                    help="csv or jsonl (default: csv)."),
+        make_option("--output", dest="output", default=None,
+                    help="File to write to (default: standard output)."),
+        make_option("--gzip", dest="gzip", action="store_true", default=False,
+                    help="Compress the output with gzip."),
+        make_option("--site", dest="site", type="int", default=None,
+                    help="Export only the mails of the site with this id."),
+        make_option("--since", dest="since", default=None,
+                    help="Export mails submitted on or after YYYY-MM-DD."),
+        make_option("--until", dest="until", default=None,
+                    help="Export mails submitted before YYYY-MM-DD."),
+        make_option("--chunk-size", dest="chunk_size", type="int",
+                    default=1000,
+                    help="Rows read per query (default: 1000)."),
+    )
+
+    def handle_noargs(self, **options):
+        queryset = ContactMail.objects.all()
+        if options["site"] is not None:
+            queryset = ContactMail.objects.for_site(options["site"])
+        if options["since"]:
+            queryset = queryset.filter(
+                submit_date__gte=parse_date(options["since"], "--since"))
+        if options["until"]:
+            queryset = queryset.filter(
+                submit_date__lt=parse_date(options["until"], "--until"))
+
+        if options["output"]:
+            stream = open(options["output"], "wb")
+        else:
+            stream = self.stdout
+        output = stream
+        if options["gzip"]:
+            output = gzip.GzipFile(fileobj=stream, mode="wb")
+        try:
+            for data in export_contact_mails(queryset, options["format"],
+                                             options["chunk_size"]):
+                output.write(data)
+        finally:
+            if output is not stream:
+                output.close()
+            if options["output"]:
+                stream.close()
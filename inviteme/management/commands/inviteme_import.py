@@ -0,0 +1,190 @@
+import csv
+import datetime
+import gzip
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import CommandError, LabelCommand
+from django.core.validators import validate_email
+from django.utils import simplejson
+
+from inviteme.bulk import EXPORT_FORMATS, insert_rows
+from inviteme.models import ContactMail
+from inviteme.normalize import is_blocked, normalize_email
+
+
+IMPORT_FIELDS = ("email", "site_id", "submit_date", "ip_address",
+                 "admin_notified")
+
+DATE_FORMATS = ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d")
+
+
+def parse_date(value):
+    if not isinstance(value, basestring):
+        raise ValueError("Invalid date: %r" % value)
+    value = value.split(".")[0] # ignore microseconds
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError("Unknown date format: %r" % value)
+
+
+def parse_site_id(value, default):
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool) or not isinstance(value, (basestring, int,
+                                                         long)):
+        raise ValueError("Invalid site_id: %r" % value)
+    return int(value)
+
+
+def get_text(row, name):
+    """Return the stripped string in ``row[name]``, or None if it's empty."""
+    value = row.get(name)
+    if value is None:
+        return None
+    if not isinstance(value, basestring):
+        raise ValueError("Invalid %s: %r" % (name, value))
+    return value.strip() or None
+
+
+# Readers return an iterator of the records of a file, parsers turn each
+# record into a dict, raising ValueError if they can't. Records are parsed
+# one at a time by import_rows, so that a bad one only skips its row.
+
+def read_csv(stream):
+    return csv.DictReader(stream)
+
+
+def parse_csv(row):
+    # Missing values are None, undecodable ones raise UnicodeDecodeError,
+    # a ValueError.
+    return dict((key, value and value.decode("utf-8"))
+                for key, value in row.items() if key)
+
+
+def read_jsonl(stream):
+    return (line for line in stream if line.strip())
+
+
+def parse_jsonl(line):
+    row = simplejson.loads(line)
+    if not isinstance(row, dict):
+        raise ValueError("Not a JSON object")
+    return row
+
+
+FORMATS = {"csv": (read_csv, parse_csv), "jsonl": (read_jsonl, parse_jsonl)}
+
+
+class Command(LabelCommand):
+    args = "<file file ...>"
+    label = "file"
+    help = ("Import already confirmed contact mails from CSV or JSON lines "
+            "files, like the ones written by inviteme_export. Only the "
+            "'email' column is required. Addresses are normalised like in "
+            "the mail form. Addresses already registered in their site "
+            "and of blocked domains are skipped.")
+
+    option_list = LabelCommand.option_list + (
+        make_option("--format", dest="format", default=None,
+                    choices=EXPORT_FORMATS,
+                    help="csv or jsonl (default: guessed from the file "
+                         "extension)."),
+        make_option("--site", dest="site", type="int", default=None,
+                    help="Site id for rows without one (default: SITE_ID)."),
+        make_option("--batch-size", dest="batch_size", type="int",
+                    default=1000,
+                    help="Rows inserted per query (default: 1000)."),
+    )
+
+    def handle_label(self, path, **options):
+        self.verbosity = int(options.get("verbosity", 1))
+        format = options["format"]
+        name = path[:-3] if path.endswith(".gz") else path
+        if format is None:
+            format = name.rsplit(".", 1)[-1]
+            if format not in EXPORT_FORMATS:
+                raise CommandError("Can't guess the format of %s, "
+                                   "use --format" % path)
+        if path.endswith(".gz"):
+            stream = gzip.open(path, "rb")
+        else:
+            stream = open(path, "rb")
+        try:
+            read, parse = FORMATS[format]
+            self.import_rows(read(stream), parse, options["site"] or
+                             settings.SITE_ID, options["batch_size"])
+        finally:
+            stream.close()
+
+    def import_rows(self, records, parse, site_id, batch_size):
+        self.imported = self.duplicated = self.invalid = 0
+        start = time.time()
+        now = datetime.datetime.now()
+        batch = {}
+        records = iter(records)
+        while True:
+            record = None
+            try:
+                # csv.Error is raised while reading a malformed line, the
+                # reader goes on with the next one.
+                record = records.next()
+                row = parse(record)
+                email = get_text(row, "email") or ""
+                validate_email(email)
+                email = normalize_email(email)
+                if is_blocked(email):
+                    raise ValueError("Blocked domain")
+                submit_date = get_text(row, "submit_date")
+                values = (email, parse_site_id(row.get("site_id"), site_id),
+                          submit_date and parse_date(submit_date) or now,
+                          get_text(row, "ip_address"), True)
+            except StopIteration:
+                break
+            except (ValidationError, ValueError, csv.Error), e:
+                self.invalid += 1
+                if self.verbosity > 1:
+                    self.stderr.write("Skipping %r: %s\n" % (record, e))
+                continue
+            if values[:2] in batch:
+                self.duplicated += 1
+                continue
+            batch[values[:2]] = values
+            if len(batch) >= batch_size:
+                self.insert_batch(batch)
+                batch = {}
+        self.insert_batch(batch)
+        elapsed = max(time.time() - start, 1e-6)
+        if self.verbosity > 0:
+            self.stdout.write(
+                "%d imported, %d duplicated, %d invalid in %.1f seconds "
+                "(%d rows/sec)\n" % (self.imported, self.duplicated,
+                                     self.invalid, elapsed,
+                                     self.imported / elapsed))
+
+    def insert_batch(self, batch):
+        """
+        Insert the rows in batch whose (email, site_id) is not in the
+        database.
+        """
+        if not batch:
+            return
+        # Looked up per site, and unordered, so that the (site_id, email)
+        # unique index is used.
+        sites = {}
+        for email, site_id in batch:
+            sites.setdefault(site_id, []).append(email)
+        existing = set()
+        for site_id, emails in sites.items():
+            existing.update(
+                ContactMail.objects.filter(site=site_id, email__in=emails)
+                .order_by().values_list("email", "site_id"))
+        rows = [values for key, values in batch.items()
+                if key not in existing]
+        self.duplicated += len(batch) - len(rows)
+        self.imported += insert_rows(ContactMail, IMPORT_FIELDS, rows)
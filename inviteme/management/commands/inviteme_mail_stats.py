@@ -0,0 +1,25 @@
+import datetime
+
+from django.core.management.base import NoArgsCommand
+from django.db.models import Count, Min
+
+from inviteme.models import OutboxMail
+
+
+class Command(NoArgsCommand):
+    help = ("Show the state of the inviteme outbox. Counters of the mail "
+            "sent by each web process are forwarded by the "
+            "INVITEME_MAIL_METRICS_HOOK.")
+
+    def handle_noargs(self, **options):
+        counts = dict((row["status"], row["count"]) for row in
+                      OutboxMail.objects.values("status")
+                      .annotate(count=Count("pk")).order_by())
+        for status, label in OutboxMail.STATUS_CHOICES:
+            self.stdout.write("%-8s %d\n" % (status, counts.get(status, 0)))
+        oldest = OutboxMail.objects.filter(
+            status=OutboxMail.PENDING).aggregate(oldest=Min("created"))
+        if oldest["oldest"] is not None:
+            age = datetime.datetime.now() - oldest["oldest"]
+            self.stdout.write("oldest pending message queued %d seconds ago\n"
+                              % (age.days * 86400 + age.seconds))
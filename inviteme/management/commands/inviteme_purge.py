@@ -0,0 +1,96 @@
+import datetime
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import CommandError, NoArgsCommand
+
+from inviteme.bulk import delete_rows
+from inviteme.models import ContactMail
+
+
+INVITEME_RETENTION_DAYS = getattr(settings, "INVITEME_RETENTION_DAYS", None)
+INVITEME_RETENTION_DAYS_PER_SITE = getattr(settings,
+                                           "INVITEME_RETENTION_DAYS_PER_SITE",
+                                           {})
+
+
+def retention_policies(site=None, older_than=None):
+    """
+    Return a list of (queryset, days) with the contact mails of each site
+    and the number of days they are kept. ``older_than`` and ``site``
+    override the settings.
+    """
+    if older_than is not None:
+        queryset = ContactMail.objects.all()
+        if site is not None:
+            queryset = ContactMail.objects.for_site(site)
+        return [(queryset, older_than)]
+    policies = []
+    for site_id, days in INVITEME_RETENTION_DAYS_PER_SITE.items():
+        if days is not None and site in (None, site_id):
+            policies.append((ContactMail.objects.for_site(site_id), days))
+    if INVITEME_RETENTION_DAYS is not None and (
+            site not in INVITEME_RETENTION_DAYS_PER_SITE):
+        queryset = ContactMail.objects.exclude(
+            site__in=INVITEME_RETENTION_DAYS_PER_SITE.keys())
+        if site is not None:
+            queryset = ContactMail.objects.for_site(site)
+        policies.append((queryset, INVITEME_RETENTION_DAYS))
+    return policies
+
+
+class Command(NoArgsCommand):
+    help = ("Delete the contact mails submitted more than --older-than "
+            "days ago, or than INVITEME_RETENTION_DAYS and "
+            "INVITEME_RETENTION_DAYS_PER_SITE say. Rows are deleted "
+            "--batch-size at a time, each batch in its own transaction, so "
+            "that it can run while the site is being used.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--older-than", dest="older_than", type="int",
+                    default=None,
+                    help="Delete the mails submitted more than this number "
+                         "of days ago (default: the retention settings)."),
+        make_option("--site", dest="site", type="int", default=None,
+                    help="Delete only the mails of the site with this id."),
+        make_option("--batch-size", dest="batch_size", type="int",
+                    default=1000,
+                    help="Rows deleted per query (default: 1000)."),
+        make_option("--sleep", dest="sleep", type="float", default=0.1,
+                    help="Seconds to wait between batches, to let other "
+                         "queries in (default: 0.1)."),
+        make_option("--dry-run", dest="dry_run", action="store_true",
+                    default=False,
+                    help="Only count the mails that would be deleted."),
+    )
+
+    def handle_noargs(self, **options):
+        self.verbosity = int(options.get("verbosity", 1))
+        policies = retention_policies(options["site"], options["older_than"])
+        if not policies:
+            raise CommandError("No retention policy: use --older-than or set "
+                               "INVITEME_RETENTION_DAYS")
+        now = datetime.datetime.now()
+        start = time.time()
+        deleted = 0
+        for queryset, days in policies:
+            queryset = queryset.filter(
+                submit_date__lt=now - datetime.timedelta(days=days))
+            if options["dry_run"]:
+                deleted += queryset.count()
+                continue
+            def progress(done, previous=deleted):
+                if self.verbosity > 1:
+                    self.stdout.write("%d contact mails deleted\n" %
+                                      (previous + done))
+            deleted += delete_rows(queryset, options["batch_size"],
+                                   options["sleep"], progress)
+        if self.verbosity > 0:
+            if options["dry_run"]:
+                self.stdout.write("%d contact mails would be deleted\n" %
+                                  deleted)
+            else:
+                self.stdout.write("%d contact mails deleted in %.1f "
+                                  "seconds\n" % (deleted,
+                                                 time.time() - start))
@@ -0,0 +1,72 @@
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.management.base import NoArgsCommand
+from django.db.models import Count, Max
+from django.template import Context
+from django.utils.translation import ugettext as _
+
+from inviteme import utils
+from inviteme.models import ContactMail
+
+
+class Command(NoArgsCommand):
+    help = ("Send the INVITEME_NOTIFY_TO addresses one email per site "
+            "listing the contact mails confirmed since the last digest. "
+            "With INVITEME_NOTIFY_DIGEST on, confirmations wait for this "
+            "command instead of being notified one by one.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--listed", dest="listed", type="int", default=100,
+                    help="Addresses listed in each digest, the rest are "
+                         "only counted (default: 100)."),
+        make_option("--loop", dest="loop", action="store_true", default=False,
+                    help="Keep sending a digest every --interval seconds "
+                         "instead of exiting."),
+        make_option("--interval", dest="interval", type="float", default=3600,
+                    help="Seconds between digests with --loop "
+                         "(default: 3600)."),
+    )
+
+    def handle_noargs(self, **options):
+        self.verbosity = int(options.get("verbosity", 1))
+        while True:
+            self.send_digests(options["listed"])
+            # the mail is sent by the dispatcher threads
+            utils.mail_dispatcher.join()
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+
+    def send_digests(self, listed):
+        pending = ContactMail.objects.filter(admin_notified=False)
+        # Mails confirmed while the digests are sent go in the next ones.
+        last_pk = pending.aggregate(last=Max("pk"))["last"]
+        if last_pk is None:
+            if self.verbosity > 1:
+                self.stdout.write("No contact mails to notify.\n")
+            return
+        pending = pending.filter(pk__lte=last_pk)
+        for row in pending.values("site").annotate(count=Count("pk")).order_by():
+            site = Site.objects.get(pk=row["site"])
+            site_pending = pending.filter(site=site)
+            contact_mails = list(site_pending.order_by("pk")[:listed])
+            self.send_digest(site, contact_mails, row["count"])
+            site_pending.update(admin_notified=True)
+            if self.verbosity > 0:
+                self.stdout.write("%s: %d contact mails notified\n" %
+                                  (site.domain, row["count"]))
+
+    def send_digest(self, site, contact_mails, count,
+                    template="inviteme/request_digest_email.txt"):
+        subject = "[%s] %s" % (site.name, _("%d new invitation requests") %
+                               count)
+        message_context = Context({'site': site,
+                                   'contact_mails': contact_mails,
+                                   'count': count,
+                                   'not_listed': count - len(contact_mails)})
+        utils.send_templated_mail(subject, template, message_context,
+                                  settings.DEFAULT_FROM_EMAIL,
+                                  utils.notify_to)
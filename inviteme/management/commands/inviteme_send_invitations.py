@@ -0,0 +1,58 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from inviteme.invitations import INVITEME_INVITATION_RATE, send_invitations
+from inviteme.models import ContactMail
+
+
+class Command(NoArgsCommand):
+    help = ("Send an invitation to the contact mails not invited yet. "
+            "Mails are marked as invited once the mail backend accepts "
+            "their invitation, run it again to resume after a failure.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--site", dest="site", type="int", default=None,
+                    help="Invite only the mails of the site with this id."),
+        make_option("--chunk-size", dest="chunk_size", type="int",
+                    default=100,
+                    help="Rows read and marked as invited per query "
+                         "(default: 100)."),
+        make_option("--rate", dest="rate", type="float",
+                    default=INVITEME_INVITATION_RATE,
+                    help="Invitations sent per second at most, 0 for no "
+                         "limit (default: INVITEME_INVITATION_RATE)."),
+        make_option("--template", dest="template",
+                    default="inviteme/invitation_email.txt",
+                    help="Template of the message body (default: "
+                         "inviteme/invitation_email.txt)."),
+        make_option("--html-template", dest="html_template", default=None,
+                    help="Template of the HTML alternative, if any."),
+        make_option("--dry-run", dest="dry_run", action="store_true",
+                    default=False,
+                    help="Only count the mails that would be invited."),
+    )
+
+    def handle_noargs(self, **options):
+        self.verbosity = int(options.get("verbosity", 1))
+        queryset = ContactMail.objects.all()
+        if options["site"] is not None:
+            queryset = ContactMail.objects.for_site(options["site"])
+        if options["dry_run"]:
+            self.stdout.write("%d contact mails to invite\n" %
+                              queryset.filter(invited_date__isnull=True)
+                              .count())
+            return
+
+        start = time.time()
+        def progress(sent):
+            if self.verbosity > 1:
+                self.stdout.write("%d invitations sent\n" % sent)
+        sent = send_invitations(queryset, options["chunk_size"],
+                                options["rate"], options["template"],
+                                options["html_template"], progress)
+        elapsed = max(time.time() - start, 1e-6)
+        if self.verbosity > 0:
+            self.stdout.write("%d invitations sent in %.1f seconds "
+                              "(%d/sec)\n" % (sent, elapsed, sent / elapsed))
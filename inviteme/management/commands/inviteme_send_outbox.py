@@ -0,0 +1,81 @@
+import os
+import socket
+import time
+import traceback
+import uuid
+from optparse import make_option
+
+from django.core.mail import get_connection
+from django.core.management.base import NoArgsCommand
+
+from inviteme.metrics import mail_metrics
+from inviteme.models import OutboxMail
+
+
+class Command(NoArgsCommand):
+    help = "Send the email messages waiting in the inviteme outbox."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--batch-size", dest="batch_size", type="int", default=100,
+                    help="Messages claimed at once (default: 100)."),
+        make_option("--max-attempts", dest="max_attempts", type="int",
+                    default=5,
+                    help="Attempts before a message is given up (default: 5)."),
+        make_option("--backoff", dest="backoff", type="int", default=60,
+                    help="Seconds to wait before the first retry, doubled on "
+                         "each attempt (default: 60)."),
+        make_option("--stale", dest="stale", type="int", default=600,
+                    help="Seconds after which messages claimed by a worker "
+                         "that did not finish are sent again (default: 600)."),
+        make_option("--loop", dest="loop", action="store_true", default=False,
+                    help="Keep polling the outbox instead of exiting when "
+                         "it is empty."),
+        make_option("--interval", dest="interval", type="float", default=5,
+                    help="Seconds between polls with --loop (default: 5)."),
+    )
+
+    def handle_noargs(self, **options):
+        self.verbosity = int(options.get("verbosity", 1))
+        worker = "%s:%d" % (socket.gethostname()[:40], os.getpid())
+        while True:
+            OutboxMail.objects.release_stale(options["stale"])
+            claimed_by = "%s:%s" % (worker, uuid.uuid4().hex[:8])
+            batch = OutboxMail.objects.claim(options["batch_size"], claimed_by)
+            if batch:
+                self.send_batch(batch, options["max_attempts"],
+                                options["backoff"])
+            elif options["loop"]:
+                time.sleep(options["interval"])
+            else:
+                break
+
+    def send_batch(self, batch, max_attempts, backoff):
+        sent = failed = 0
+        connection = None
+        for outbox_mail in batch:
+            try:
+                if connection is None:
+                    connection = get_connection()
+                    connection.open()
+                start = time.time()
+                connection.send_messages([outbox_mail.as_message()])
+            except Exception:
+                outbox_mail.mark_failed(traceback.format_exc(), max_attempts,
+                                        backoff)
+                mail_metrics.incr("failed")
+                failed += 1
+                # The connection may be broken, open a new one.
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+                connection = None
+            else:
+                mail_metrics.observe_latency(time.time() - start)
+                mail_metrics.incr("sent")
+                outbox_mail.mark_sent()
+                sent += 1
+        if connection is not None:
+            connection.close()
+        if self.verbosity > 0:
+            self.stdout.write("%d sent, %d failed\n" % (sent, failed))
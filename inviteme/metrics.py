@@ -0,0 +1,203 @@
+"""
+Delivery metrics of the mail sent by django-inviteme.
+
+``mail_metrics`` keeps per process counters of the messages queued, sent,
+failed, dropped and deduplicated (not sent, see ``inviteme.dedupe``), and a
+histogram of the time spent handing each message to the mail backend.
+Every event is also passed to the callable named by
+``INVITEME_MAIL_METRICS_HOOK``, if any, to forward it to a monitoring system.
+
+The views report the time taken by each stage of a request to the callable
+named by ``INVITEME_TIMING_CALLBACK``, through a ``Timer``.
+"""
+
+import bisect
+import logging
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.importlib import import_module
+from django.utils.log import NullHandler
+
+
+INVITEME_MAIL_METRICS_HOOK = getattr(settings, "INVITEME_MAIL_METRICS_HOOK",
+                                     None)
+INVITEME_TIMING_CALLBACK = getattr(settings, "INVITEME_TIMING_CALLBACK", None)
+INVITEME_STATSD_ADDRESS = getattr(settings, "INVITEME_STATSD_ADDRESS",
+                                  ("localhost", 8125))
+INVITEME_STATSD_PREFIX = getattr(settings, "INVITEME_STATSD_PREFIX",
+                                 "inviteme")
+
+# Upper bounds, in seconds, of the send latency histogram buckets.
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+COUNTERS = ("queued", "sent", "failed", "dropped", "deduplicated")
+
+
+logger = logging.getLogger("inviteme.metrics")
+logger.addHandler(NullHandler())
+
+
+def load_hook(path):
+    """Return the callable at the dotted ``path``."""
+    try:
+        module, attr = path.rsplit(".", 1)
+        return getattr(import_module(module), attr)
+    except (ValueError, ImportError, AttributeError), e:
+        raise ImproperlyConfigured("Error loading inviteme hook %r: %s" %
+                                   (path, e))
+
+
+def log_hook(event, value):
+    """
+    Hook that logs every event to the ``inviteme.metrics`` logger. Use it
+    with ``INVITEME_MAIL_METRICS_HOOK = 'inviteme.metrics.log_hook'``.
+    """
+    logger.info("%s %s", event, value)
+
+
+class MailMetrics(object):
+    """
+    Thread safe counters and send latency histogram. ``hook`` is called
+    with ``(event, value)`` for every counter increment, with ``value``
+    being the increment, and for every latency measured, with ``event``
+    being ``"latency"`` and ``value`` the seconds. Errors of the hook are
+    logged and ignored: it is called from the dispatcher worker threads,
+    which must keep sending mail.
+    """
+
+    def __init__(self, hook=None):
+        self.hook = hook
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.counters = dict((name, 0) for name in COUNTERS)
+            self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+            self.latency_sum = 0.0
+        finally:
+            self._lock.release()
+
+    def incr(self, name, value=1):
+        self._lock.acquire()
+        try:
+            self.counters[name] += value
+        finally:
+            self._lock.release()
+        self._call_hook(name, value)
+
+    def observe_latency(self, seconds):
+        index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        self._lock.acquire()
+        try:
+            self.latency_buckets[index] += 1
+            self.latency_sum += seconds
+        finally:
+            self._lock.release()
+        self._call_hook("latency", seconds)
+
+    def _call_hook(self, event, value):
+        if self.hook:
+            try:
+                self.hook(event, value)
+            except Exception:
+                logger.exception("Error in the mail metrics hook")
+
+    def snapshot(self):
+        """
+        Return a dict with the counters, the ``latency_sum`` and the
+        ``latency`` histogram as a list of ``(upper bound, count)`` pairs,
+        the last bound being None.
+        """
+        self._lock.acquire()
+        try:
+            stats = dict(self.counters)
+            stats["latency_sum"] = self.latency_sum
+            stats["latency"] = zip(LATENCY_BUCKETS + (None,),
+                                   self.latency_buckets)
+        finally:
+            self._lock.release()
+        return stats
+
+
+mail_metrics = MailMetrics(INVITEME_MAIL_METRICS_HOOK and
+                           load_hook(INVITEME_MAIL_METRICS_HOOK))
+
+
+def log_timing(stage, seconds):
+    """
+    Timing callback that logs every stage to the ``inviteme.metrics``
+    logger. Use it with
+    ``INVITEME_TIMING_CALLBACK = 'inviteme.metrics.log_timing'``.
+    """
+    logger.info("%s took %.2fms", stage, seconds * 1000)
+
+
+_statsd_socket = None
+
+def statsd_timing(stage, seconds):
+    """
+    Timing callback that sends every stage as a statsd timer to
+    ``INVITEME_STATSD_ADDRESS``, named ``INVITEME_STATSD_PREFIX.<stage>``.
+    Use it with
+    ``INVITEME_TIMING_CALLBACK = 'inviteme.metrics.statsd_timing'``.
+    Packets are sent over UDP and never block or fail the request.
+    """
+    global _statsd_socket
+    try:
+        if _statsd_socket is None:
+            _statsd_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        _statsd_socket.sendto("%s.%s:%.3f|ms" % (INVITEME_STATSD_PREFIX, stage,
+                                                 seconds * 1000),
+                              INVITEME_STATSD_ADDRESS)
+    except socket.error:
+        pass
+
+
+class Timer(object):
+    """
+    Measures the consecutive stages of a request. Every call to ``mark``
+    passes ``("<name>.<stage>", seconds)`` to ``callback``, with the
+    seconds since the previous mark or since the timer was created, and
+    ``total`` the seconds since the timer was created as ``<name>.total``.
+    """
+
+    def __init__(self, callback, name):
+        self.callback = callback
+        self.name = name
+        self.start = self.last = time.time()
+
+    def mark(self, stage):
+        now = time.time()
+        self.callback("%s.%s" % (self.name, stage), now - self.last)
+        self.last = now
+
+    def total(self):
+        self.callback("%s.total" % self.name, time.time() - self.start)
+
+
+class NullTimer(object):
+    """Timer doing nothing, used when there is no timing callback."""
+
+    def mark(self, stage):
+        pass
+
+    def total(self):
+        pass
+
+null_timer = NullTimer()
+
+
+timing_callback = (INVITEME_TIMING_CALLBACK and
+                   load_hook(INVITEME_TIMING_CALLBACK))
+
+def start_timer(name):
+    """Return a ``Timer`` for the request ``name``, or the ``null_timer``."""
+    if not timing_callback:
+        return null_timer
+    return Timer(timing_callback, name)
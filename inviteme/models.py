@@ -1,23 +1,74 @@
 import datetime
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.conf import settings
 from django.contrib.sites.models import Site
+from django.core.mail import EmailMultiAlternatives
 from django.utils.translation import ugettext_lazy as _
 
 
+class ContactMailManager(models.Manager):
+
+    def for_site(self, site):
+        """
+        The mails of ``site``, a ``Site`` or its id. Lookups by email and
+        listings by date of one site use the ``(site_id, email)`` and
+        ``(site_id, submit_date)`` indexes.
+        """
+        return self.filter(site=site)
+
+    def create_unique(self, **kwargs):
+        """
+        Create a ``ContactMail`` with a single ``INSERT``. Returns None,
+        instead of raising ``IntegrityError``, if the email address is
+        already registered in the site.
+
+        The ``INSERT`` is run within a savepoint, so that a duplicate only
+        rolls back the ``INSERT`` and not the work of a caller in a
+        transaction. Without one the ``INSERT`` is committed.
+        """
+        contact_mail = self.model(**kwargs)
+        managed = transaction.is_managed(using=self.db)
+        if not managed:
+            transaction.enter_transaction_management(using=self.db)
+            transaction.managed(True, using=self.db)
+        try:
+            sid = transaction.savepoint(using=self.db)
+            try:
+                contact_mail.save(force_insert=True, using=self.db)
+            except IntegrityError:
+                transaction.savepoint_rollback(sid, using=self.db)
+                contact_mail = None
+            else:
+                transaction.savepoint_commit(sid, using=self.db)
+            if not managed:
+                transaction.commit(using=self.db)
+            return contact_mail
+        finally:
+            if not managed:
+                transaction.leave_transaction_management(using=self.db)
+
+
 class ContactMail(models.Model):
     """
     An incoming message from a site visitor.
     """
     site = models.ForeignKey(Site)
-    email = models.EmailField(_("Contact's email address"), primary_key=True)
-    submit_date = models.DateTimeField(_("Date/Time submitted"), default=None)
+    email = models.EmailField(_("Contact's email address"))
+    submit_date = models.DateTimeField(_("Date/Time submitted"), default=None,
+                                       db_index=True)
     ip_address  = models.IPAddressField(_('IP address'), blank=True, null=True)
+    admin_notified = models.BooleanField(_("Admins notified"), default=True,
+                                         help_text=_("False until the mail "
+                                                     "is sent in a digest"))
+    invited_date = models.DateTimeField(_("Invited"), blank=True, null=True)
+
+    objects = ContactMailManager()
     
     class Meta:
         db_table = "inviteme_contact_mail"
         ordering = ('submit_date',)
+        unique_together = (('site', 'email'),)
         verbose_name = _('contact mail')
         verbose_name_plural = _('contact mails')
 
@@ -28,3 +79,127 @@ class ContactMail(models.Model):
         if self.submit_date is None:
             self.submit_date = datetime.datetime.now()
         super(ContactMail, self).save(*args, **kwargs)
+
+
+class OutboxMailManager(models.Manager):
+
+    def enqueue(self, message):
+        """
+        Store an ``EmailMessage`` to be sent later by the
+        ``inviteme_send_outbox`` management command.
+        """
+        html = ""
+        for content, mimetype in getattr(message, "alternatives", []):
+            if mimetype == "text/html":
+                html = content
+        return self.create(subject=message.subject, body=message.body,
+                           html=html, from_email=message.from_email,
+                           recipients="\n".join(message.recipients()))
+
+    def claim(self, limit, claimed_by):
+        """
+        Mark up to ``limit`` pending messages as being sent by ``claimed_by``
+        and return them. The conditional ``UPDATE`` guarantees that a message
+        is claimed only once, even with several workers on several nodes.
+        """
+        now = datetime.datetime.now()
+        pks = list(self.filter(status=OutboxMail.PENDING,
+                               next_attempt__lte=now)
+                   .order_by("next_attempt")
+                   .values_list("pk", flat=True)[:limit])
+        if not pks:
+            return []
+        self.filter(pk__in=pks, status=OutboxMail.PENDING).update(
+            status=OutboxMail.SENDING, claimed_by=claimed_by, claimed_date=now)
+        return list(self.filter(pk__in=pks, status=OutboxMail.SENDING,
+                                claimed_by=claimed_by))
+
+    def release_stale(self, seconds):
+        """
+        Put back in the pending state the messages claimed more than
+        ``seconds`` ago by a worker that did not finish sending them.
+        """
+        limit = datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+        return self.filter(status=OutboxMail.SENDING,
+                           claimed_date__lt=limit).update(
+            status=OutboxMail.PENDING, claimed_by="", claimed_date=None)
+
+
+class OutboxMail(models.Model):
+    """
+    An email message waiting to be sent by the ``inviteme_send_outbox``
+    management command.
+    """
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, _("Pending")),
+        (SENDING, _("Sending")),
+        (SENT,    _("Sent")),
+        (FAILED,  _("Failed")),
+    )
+
+    subject = models.CharField(_("Subject"), max_length=255)
+    body = models.TextField(_("Body"))
+    html = models.TextField(_("HTML body"), blank=True)
+    from_email = models.CharField(_("From"), max_length=255)
+    recipients = models.TextField(_("Recipients"),
+                                  help_text=_("One address per line"))
+    status = models.CharField(_("Status"), max_length=8, db_index=True,
+                              choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(_("Attempts"), default=0)
+    next_attempt = models.DateTimeField(_("Next attempt"), db_index=True,
+                                        default=datetime.datetime.now)
+    claimed_by = models.CharField(_("Claimed by"), max_length=64, blank=True)
+    claimed_date = models.DateTimeField(_("Claimed"), blank=True, null=True)
+    created = models.DateTimeField(_("Created"),
+                                   default=datetime.datetime.now)
+    sent_date = models.DateTimeField(_("Sent"), blank=True, null=True)
+    last_error = models.TextField(_("Last error"), blank=True)
+
+    objects = OutboxMailManager()
+
+    class Meta:
+        db_table = "inviteme_outbox_mail"
+        ordering = ('created',)
+        verbose_name = _('outbox mail')
+        verbose_name_plural = _('outbox mails')
+
+    def __unicode__(self):
+        return "%s" % self.subject
+
+    def get_recipients(self):
+        return [addr for addr in self.recipients.splitlines() if addr]
+
+    def as_message(self):
+        msg = EmailMultiAlternatives(self.subject, self.body, self.from_email,
+                                     self.get_recipients())
+        if self.html:
+            msg.attach_alternative(self.html, "text/html")
+        return msg
+
+    def mark_sent(self):
+        self.status = self.SENT
+        self.sent_date = datetime.datetime.now()
+        self.last_error = ""
+        self.save()
+
+    def mark_failed(self, error, max_attempts, backoff):
+        """
+        Record a failed attempt. The message is tried again after ``backoff``
+        seconds, doubled on each attempt, up to ``max_attempts`` attempts.
+        """
+        self.attempts += 1
+        self.last_error = error
+        self.claimed_by = ""
+        self.claimed_date = None
+        if self.attempts >= max_attempts:
+            self.status = self.FAILED
+        else:
+            self.status = self.PENDING
+            delay = backoff * 2 ** (self.attempts - 1)
+            self.next_attempt = (datetime.datetime.now() +
+                                 datetime.timedelta(seconds=delay))
+        self.save()
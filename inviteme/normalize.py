@@ -0,0 +1,88 @@
+"""
+Normalisation of the email addresses given in the mail form, so that one
+mailbox is registered once however its address is typed, and the blocked
+domains, whose addresses are refused.
+"""
+
+from django.conf import settings
+
+
+INVITEME_EMAIL_LOWERCASE = getattr(settings, "INVITEME_EMAIL_LOWERCASE", True)
+INVITEME_EMAIL_STRIP_PLUS_TAGS = getattr(settings,
+                                         "INVITEME_EMAIL_STRIP_PLUS_TAGS",
+                                         False)
+INVITEME_BLOCKED_DOMAINS = getattr(settings, "INVITEME_BLOCKED_DOMAINS", ())
+INVITEME_BLOCKED_DOMAINS_FILE = getattr(settings,
+                                        "INVITEME_BLOCKED_DOMAINS_FILE", None)
+
+
+def normalize_domain(domain):
+    """
+    Return ``domain`` lowercased and IDNA encoded, with ``xn--`` labels
+    for non ASCII names. Raises ValueError if it can't be encoded.
+    """
+    domain = unicode(domain).strip().rstrip(".").lower()
+    try:
+        return unicode(domain.encode("idna"))
+    except UnicodeError, e:
+        raise ValueError("Invalid domain %r: %s" % (domain, e))
+
+
+def normalize_email(email, lowercase=None, strip_plus_tags=None):
+    """
+    Return ``email`` with its domain normalised, its local part lowercased
+    if ``lowercase`` is True and without ``+tag`` suffix if
+    ``strip_plus_tags`` is True. Both default to their settings. Raises
+    ValueError for addresses without local part or domain.
+    """
+    if lowercase is None:
+        lowercase = INVITEME_EMAIL_LOWERCASE
+    if strip_plus_tags is None:
+        strip_plus_tags = INVITEME_EMAIL_STRIP_PLUS_TAGS
+    local, at, domain = email.strip().rpartition("@")
+    if not local or not domain:
+        raise ValueError("Invalid email address %r" % email)
+    if lowercase:
+        local = local.lower()
+    if strip_plus_tags and not local.startswith("+"):
+        local = local.split("+", 1)[0]
+    return u"%s@%s" % (local, normalize_domain(domain))
+
+
+def load_blocked_domains(domains=(), path=None):
+    """
+    Return a frozenset with the normalised ``domains`` and the ones listed
+    in the file at ``path``, one per line. Empty lines and lines starting
+    with ``#`` are skipped.
+    """
+    domains = list(domains)
+    if path:
+        blocked_file = open(path)
+        try:
+            for line in blocked_file:
+                line = line.decode("utf-8").strip()
+                if line and not line.startswith("#"):
+                    domains.append(line)
+        finally:
+            blocked_file.close()
+    return frozenset([normalize_domain(domain) for domain in domains])
+
+
+# Loaded once per process.
+blocked_domains = load_blocked_domains(INVITEME_BLOCKED_DOMAINS,
+                                       INVITEME_BLOCKED_DOMAINS_FILE)
+
+
+def is_blocked(email):
+    """
+    Return True if the domain of the normalised ``email``, or any domain it
+    is a subdomain of, is blocked.
+    """
+    if not blocked_domains:
+        return False
+    domain = email.rpartition("@")[2]
+    while domain:
+        if domain in blocked_domains:
+            return True
+        domain = domain.partition(".")[2]
+    return False
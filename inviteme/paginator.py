@@ -0,0 +1,63 @@
+"""
+Paginator for admin changelists of large tables, where ``SELECT COUNT(*)``
+has to scan the whole table and takes longer than fetching the page itself.
+"""
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections, DatabaseError
+
+
+INVITEME_ADMIN_ESTIMATED_COUNT = getattr(settings,
+                                         "INVITEME_ADMIN_ESTIMATED_COUNT", None)
+
+
+def estimated_count(queryset):
+    """
+    Return the number of rows of the table of ``queryset`` according to the
+    statistics kept by the database, or None if there are none. Only
+    PostgreSQL, MySQL and SQLite (after ``ANALYZE``) are supported.
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    engine = connection.settings_dict["ENGINE"]
+    if "postgresql" in engine:
+        sql = "SELECT reltuples FROM pg_class WHERE relname = %s"
+    elif "mysql" in engine:
+        sql = ("SELECT table_rows FROM information_schema.tables "
+               "WHERE table_schema = DATABASE() AND table_name = %s")
+    elif "sqlite" in engine:
+        sql = "SELECT stat FROM sqlite_stat1 WHERE tbl = %s"
+    else:
+        return None
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+    except DatabaseError:
+        # i.e. no sqlite_stat1 table, ANALYZE has never been run
+        return None
+    if row is None or row[0] is None:
+        return None
+    return int(str(row[0]).split()[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that, for unfiltered querysets, takes the count from the
+    database statistics when they say there are at least ``threshold``
+    rows. Smaller tables and filtered querysets are counted exactly, and so
+    is everything when ``threshold`` is None.
+    """
+    threshold = INVITEME_ADMIN_ESTIMATED_COUNT
+
+    def _get_count(self):
+        if self._count is None:
+            if self.threshold is not None and not self.object_list.query.where:
+                count = estimated_count(self.object_list)
+                if count is not None and count >= self.threshold:
+                    self._count = count
+            if self._count is None:
+                self._count = self.object_list.count()
+        return self._count
+    count = property(_get_count)
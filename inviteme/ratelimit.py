@@ -0,0 +1,80 @@
+"""
+Rate limits of the confirmation requests posted with the mail form, per
+client IP address and per email address.
+"""
+
+import time
+
+from django.conf import settings
+from django.utils.hashcompat import md5_constructor
+
+from inviteme.cache import get_store
+
+
+INVITEME_RATE_LIMIT_CACHE = getattr(settings, "INVITEME_RATE_LIMIT_CACHE",
+                                    "default")
+INVITEME_RATE_LIMIT_PER_IP = getattr(settings, "INVITEME_RATE_LIMIT_PER_IP",
+                                     None)
+INVITEME_RATE_LIMIT_PER_EMAIL = getattr(settings,
+                                        "INVITEME_RATE_LIMIT_PER_EMAIL",
+                                        (5, 3600))
+
+
+class RateLimit(object):
+    """
+    Sliding window limit of ``limit`` hits every ``period`` seconds.
+
+    Hits are counted in a cache ``store`` (see ``inviteme.cache``), in
+    windows of ``period`` seconds. The count of the sliding window is the
+    one of the current window plus the part of the previous window's that
+    the sliding window still overlaps. It takes two keys per client, and
+    ``add`` and ``incr`` are atomic in memcached and Redis, so processes
+    sharing the cache share the limit.
+    """
+
+    def __init__(self, store, limit, period, prefix):
+        self.store = store
+        self.limit = limit
+        self.period = period
+        self.prefix = prefix
+
+    def cache_key(self, ident, window):
+        if isinstance(ident, unicode):
+            ident = ident.encode("utf-8")
+        return "inviteme:%s:%s:%d" % (self.prefix,
+                                      md5_constructor(ident).hexdigest(),
+                                      window)
+
+    def hit(self, ident, now=None):
+        """Count a hit of ``ident``. Returns False if it is over the limit."""
+        if now is None:
+            now = time.time()
+        window, elapsed = divmod(now, self.period)
+        key = self.cache_key(ident, window)
+        # Windows are kept until the next one ends, while they are read.
+        timeout = int(self.period * 2)
+        if self.store.add(key, 1, timeout):
+            count = 1
+        else:
+            try:
+                count = self.store.incr(key)
+            except ValueError: # expired since add()
+                self.store.set(key, 1, timeout)
+                count = 1
+        previous = self.store.get(self.cache_key(ident, window - 1), 0)
+        overlap = 1 - float(elapsed) / self.period
+        return previous * overlap + count <= self.limit
+
+
+def get_rate_limit(setting, prefix, store):
+    if not setting:
+        return None
+    limit, period = setting
+    return RateLimit(store, limit, period, prefix)
+
+
+_store = get_store(INVITEME_RATE_LIMIT_CACHE)
+
+ip_rate_limit = get_rate_limit(INVITEME_RATE_LIMIT_PER_IP, "ip", _store)
+email_rate_limit = get_rate_limit(INVITEME_RATE_LIMIT_PER_EMAIL, "email",
+                                  _store)
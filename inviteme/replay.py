@@ -0,0 +1,55 @@
+"""
+Keys of the confirmation URLs already visited.
+
+Once a confirmation URL has been used, later visits to it (mail scanners
+follow links in messages over and over) are refused without checking the
+signature or touching the database. The database remains the authority:
+keys that are not in the cache, because they expired, were evicted or were
+used in another process, are verified as usual.
+"""
+
+import datetime
+
+from django.conf import settings
+
+from inviteme.cache import get_store
+
+
+INVITEME_USED_KEY_CACHE = getattr(settings, "INVITEME_USED_KEY_CACHE", None)
+INVITEME_USED_KEY_CACHE_SIZE = getattr(settings,
+                                       "INVITEME_USED_KEY_CACHE_SIZE", 10000)
+INVITEME_USED_KEY_TTL = getattr(settings, "INVITEME_USED_KEY_TTL",
+                                7 * 24 * 3600)
+
+
+class UsedKeys(object):
+    """
+    Set of used confirmation keys kept in ``store`` (see
+    ``inviteme.cache``). A key is remembered until ``ttl`` seconds after the
+    submit date it carries, so keys of old requests take less room.
+    """
+
+    def __init__(self, store, ttl):
+        self.store = store
+        self.ttl = ttl
+
+    def cache_key(self, key):
+        # The signature identifies the token and is short enough for
+        # memcached keys.
+        return "inviteme:used:%s" % key.rsplit(".", 1)[-1]
+
+    def __contains__(self, key):
+        return bool(self.ttl) and self.store.get(self.cache_key(key)) is not None
+
+    def add(self, key, submit_date):
+        if not self.ttl:
+            return
+        age = datetime.datetime.now() - submit_date
+        timeout = self.ttl - (age.days * 86400 + age.seconds)
+        if timeout > 0:
+            self.store.set(self.cache_key(key), 1, min(timeout, self.ttl))
+
+
+used_keys = UsedKeys(get_store(INVITEME_USED_KEY_CACHE,
+                               INVITEME_USED_KEY_CACHE_SIZE),
+                     INVITEME_USED_KEY_TTL)
@@ -1,17 +1,116 @@
 """
 Signals relating to django-inviteme.
 """
+import time
+
 from django.dispatch import Signal
+from django.dispatch.dispatcher import _make_id
+
+from inviteme import metrics
+
+
+class VetoableSignal(Signal):
+    """
+    Signal whose receivers may reject the request by returning False.
+
+    Receivers are called in the order of the ``priority`` given to
+    ``connect``, lowest first, and in the order they were connected for the
+    same priority. Connect cheap checks, like ban lists, with a low priority
+    so that they run before expensive ones, like spam checks, which
+    ``send_vetoable`` does not call once the request has been rejected.
+
+    The time taken by each receiver is passed to the
+    ``INVITEME_TIMING_CALLBACK``, as ``receivers.<signal>.<receiver>``.
+    """
+
+    def __init__(self, providing_args=None, name="signal"):
+        super(VetoableSignal, self).__init__(providing_args)
+        self.name = name
+        self.priorities = {}
+
+    def lookup_key(self, receiver, sender, dispatch_uid):
+        if dispatch_uid:
+            return (dispatch_uid, _make_id(sender))
+        return (_make_id(receiver), _make_id(sender))
+
+    def connect(self, receiver, sender=None, weak=True, dispatch_uid=None,
+                priority=0):
+        lookup_key = self.lookup_key(receiver, sender, dispatch_uid)
+        super(VetoableSignal, self).connect(receiver, sender, weak,
+                                            dispatch_uid)
+        self.lock.acquire()
+        try:
+            self.priorities[lookup_key] = priority
+            # sort() is stable, receivers of the same priority keep their
+            # order
+            self.receivers.sort(
+                key=lambda item: self.priorities.get(item[0], 0))
+        finally:
+            self.lock.release()
+
+    def disconnect(self, receiver=None, sender=None, weak=True,
+                   dispatch_uid=None):
+        super(VetoableSignal, self).disconnect(receiver, sender, weak,
+                                               dispatch_uid)
+        self.lock.acquire()
+        try:
+            self.priorities.pop(
+                self.lookup_key(receiver, sender, dispatch_uid), None)
+        finally:
+            self.lock.release()
+
+    def _remove_receiver(self, receiver):
+        # Called when a weakly referenced receiver is garbage collected.
+        super(VetoableSignal, self)._remove_receiver(receiver)
+        self.lock.acquire()
+        try:
+            live = set([key for key, connected in self.receivers])
+            for key in self.priorities.keys():
+                if key not in live:
+                    del self.priorities[key]
+        finally:
+            self.lock.release()
+
+    def send_vetoable(self, sender, **named):
+        """
+        Like ``send``, but stops calling receivers after the first one that
+        returns False. The returned list of ``(receiver, response)`` ends
+        with that receiver then.
+        """
+        responses = []
+        if not self.receivers:
+            return responses
+        callback = metrics.timing_callback
+        for receiver in self._live_receivers(_make_id(sender)):
+            if callback:
+                start = time.time()
+            response = receiver(signal=self, sender=sender, **named)
+            if callback:
+                callback("receivers.%s.%s" % (self.name,
+                                              receiver_name(receiver)),
+                         time.time() - start)
+            responses.append((receiver, response))
+            if response == False:
+                break
+        return responses
+
+
+def receiver_name(receiver):
+    return "%s.%s" % (getattr(receiver, "__module__", None),
+                      getattr(receiver, "__name__",
+                              receiver.__class__.__name__))
 
 
-confirmation_will_be_requested = Signal(providing_args=["data", "request"])
+confirmation_will_be_requested = VetoableSignal(
+    providing_args=["data", "request"], name="confirmation_will_be_requested")
 confirmation_will_be_requested.__doc__ = """
 Sent just before a confirmation message is requested.
 
 A message is sent to the user right after the contact form is been posted and 
 validated to verify the user's email address. This signal may be used to ban 
 email addresses or check message content. If any receiver returns False the 
-process is discarded and the user receives a discarded message. 
+process is discarded and the user receives a discarded message, and the
+receivers after it are not called.
 """
 
 
@@ -25,7 +124,8 @@ trace contact messages posted but never confirmed.
 """
 
 
-confirmation_received = Signal(providing_args=["data", "request"])
+confirmation_received = VetoableSignal(providing_args=["data", "request"],
+                                       name="confirmation_received")
 confirmation_received.__doc__ = """
 Sent just after a confirmation has been received.
 
@@ -33,5 +133,5 @@ A confirmation is received when the user clicks on the link provided in the
 confirmation message sent by email. This signal may be used to validate that
 the submit date stored in the URL is no older than a certain time. If any 
 receiver returns False the process is discarded and the user receives a 
-discarded message. 
+discarded message, and the receivers after it are not called.
 """
@@ -35,10 +35,29 @@ start of the base64 pickle.
 
 There are 65 url-safe characters: the 64 used by url-safe base64 and the '.'. 
 These functions make use of all of them.
+
+Confirmation URLs use dumps_mail() and loads_mail() instead, which sign only
+the email address and the submit date in a fixed binary layout: the date as
+epoch seconds in 4 bytes, big endian, followed by the UTF-8 email address.
+The token is shorter than a pickle and loading it does not unpickle anything:
+
+>>> signed.dumps_mail({'email': u'alice@example.com',
+...                    'submit_date': datetime.datetime(2012, 1, 1)})
+'1~Tv-iAGFsaWNlQGV4YW1wbGUuY29t.uOA79WUM0yfN6GB2ylwnpfbE8Jc'
+
+Tokens are prefixed with their format version and a '~', a character not
+used by dumps(), so loads_mail() still accepts the pickled tokens sent in
+confirmation emails before the format existed.
+
+HMAC objects are keyed once per key and copied for every signature. When no
+key is given, values signed with any of the old secrets listed in the
+INVITEME_SECRET_KEY_FALLBACKS setting are accepted too, so that SECRET_KEY
+can be rotated without breaking the links already sent.
 """
 
-import pickle, base64
+import calendar, datetime, pickle, base64, struct
 from django.conf import settings
+from django.utils.crypto import constant_time_compare
 from django.utils.hashcompat import sha_constructor
 import hmac
 
@@ -71,10 +90,8 @@ def loads(s, key = None, extra_key = ''):
     "Reverse of dumps(), raises ValueError if signature fails"
     if isinstance(s, unicode):
         s = s.encode('utf8') # base64 works on bytestrings, not on unicodes
-    try:
-        base64d = unsign(s, (key or settings.SECRET_KEY) + extra_key)
-    except ValueError:
-        raise
+    keys = signing_keys(key, extra_key)
+    base64d = unsign(s, keys[0], keys[1:])
     decompress = False
     if base64d[0] == '.':
         # It's compressed; uncompress it first
@@ -86,6 +103,40 @@ def loads(s, key = None, extra_key = ''):
         pickled = zlib.decompress(pickled)
     return pickle.loads(pickled)
 
+MAIL_TOKEN_VERSION = '1'
+MAIL_TOKEN_PREFIX = MAIL_TOKEN_VERSION + '~'
+
+def dumps_mail(data, key = None, extra_key = ''):
+    """
+    Returns a URL-safe, sha1 signed token with the 'email' and the
+    'submit_date' of data. The submit date is kept with a precision of
+    seconds.
+    """
+    seconds = calendar.timegm(data['submit_date'].timetuple())
+    payload = struct.pack('!I', seconds) + data['email'].encode('utf8')
+    return sign(MAIL_TOKEN_PREFIX + encode(payload),
+                (key or settings.SECRET_KEY) + extra_key)
+
+def loads_mail(s, key = None, extra_key = ''):
+    """
+    Reverse of dumps_mail(), raises ValueError if signature fails. Tokens
+    created by dumps() are loaded with loads().
+    """
+    if isinstance(s, unicode):
+        s = s.encode('utf8')
+    if not s.startswith(MAIL_TOKEN_PREFIX):
+        return loads(s, key, extra_key)
+    keys = signing_keys(key, extra_key)
+    value = unsign(s, keys[0], keys[1:])
+    try:
+        payload = decode(value[len(MAIL_TOKEN_PREFIX):])
+        seconds, = struct.unpack('!I', payload[:4])
+        email = payload[4:].decode('utf8')
+    except (TypeError, struct.error, UnicodeDecodeError):
+        raise BadSignature, 'Malformed token: %s' % value
+    return {'email': email,
+            'submit_date': datetime.datetime.utcfromtimestamp(seconds)}
+
 def encode(s):
     return base64.urlsafe_b64encode(s).strip('=')
 
@@ -105,7 +156,8 @@ def sign(value, key = None):
         key = settings.SECRET_KEY
     return value + '.' + base64_hmac(value, key)
 
-def unsign(signed_value, key = None):
+def unsign(signed_value, key = None, fallback_keys = ()):
+    "Check the signature with key and then with each of fallback_keys"
     if isinstance(signed_value, unicode):
         raise TypeError, 'unsign() needs bytestring, not unicode'
     if key is None:
@@ -113,10 +165,52 @@ def unsign(signed_value, key = None):
     if not '.' in signed_value:
         raise BadSignature, 'Missing sig (no . found in value)'
     value, sig = signed_value.rsplit('.', 1)
-    if base64_hmac(value, key) == sig:
-        return value
-    else:
-        raise BadSignature, 'Signature failed: %s' % sig
+    for k in (key,) + tuple(fallback_keys):
+        if constant_time_compare(base64_hmac(value, k), sig):
+            return value
+    raise BadSignature, 'Signature failed: %s' % sig
+
+def secret_keys():
+    "Returns settings.SECRET_KEY followed by INVITEME_SECRET_KEY_FALLBACKS"
+    return [settings.SECRET_KEY] + list(
+        getattr(settings, 'INVITEME_SECRET_KEY_FALLBACKS', ()))
+
+def signing_keys(key = None, extra_key = ''):
+    """
+    Returns the list of keys to check signatures with: key alone if given,
+    otherwise the current and old secrets, all salted with extra_key.
+    """
+    if key:
+        return [key + extra_key]
+    return [k + extra_key for k in secret_keys()]
+
+# HMAC objects keyed once, by key, and by (key_salt, secret) for salted_hmac.
+_hmac_cache = {}
+_salted_hmac_cache = {}
+_HMAC_CACHE_SIZE = 100
+
+def _cached_hmac(cache, cache_key, make_key):
+    try:
+        mac = cache[cache_key]
+    except KeyError:
+        if len(cache) >= _HMAC_CACHE_SIZE:
+            cache.clear()
+        mac = cache[cache_key] = hmac.new(make_key(), digestmod=sha_constructor)
+    return mac.copy()
 
 def base64_hmac(value, key):
-    return encode(hmac.new(key, value, sha_constructor).digest())
+    mac = _cached_hmac(_hmac_cache, key, lambda: key)
+    mac.update(value)
+    return encode(mac.digest())
+
+def salted_hmac(key_salt, value, secret = None):
+    """
+    Same result as django.utils.crypto.salted_hmac, but the key is derived
+    from key_salt and secret only once.
+    """
+    if secret is None:
+        secret = settings.SECRET_KEY
+    mac = _cached_hmac(_salted_hmac_cache, (key_salt, secret),
+                       lambda: sha_constructor(key_salt + secret).digest())
+    mac.update(value)
+    return mac
@@ -0,0 +1,63 @@
+"""
+The site a request is made to.
+
+With ``INVITEME_SITE_FROM_HOST`` on, one deployment serves several sites:
+the ``Site`` of a request is the one whose domain is the host of the
+request, or the ``SITE_ID`` one if there is none. Sites are looked up once
+per host and kept for ``INVITEME_SITE_CACHE_TTL`` seconds in an
+``LRUCache`` of the process (see ``inviteme.cache``), bounded so that
+requests with made up hosts can't make it grow. Saving or deleting a site
+clears it.
+"""
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.db.models.signals import post_delete, post_save
+
+from inviteme.cache import LRUCache
+
+
+INVITEME_SITE_FROM_HOST = getattr(settings, "INVITEME_SITE_FROM_HOST", False)
+INVITEME_SITE_CACHE_TTL = getattr(settings, "INVITEME_SITE_CACHE_TTL", 300)
+
+
+site_cache = LRUCache(max_entries=1000,
+                      default_timeout=INVITEME_SITE_CACHE_TTL)
+
+
+def get_site(request):
+    """
+    Return the ``Site`` of ``request``. Without ``INVITEME_SITE_FROM_HOST``
+    it is always the ``SITE_ID`` one.
+    """
+    if not INVITEME_SITE_FROM_HOST:
+        return Site.objects.get_current()
+    host = request.get_host().lower()
+    site = site_cache.get(host)
+    if site is None:
+        site = lookup_site(host)
+        site_cache.set(host, site)
+    return site
+
+
+def lookup_site(host):
+    """
+    Return the site whose domain is ``host``, with or without its port, or
+    the ``SITE_ID`` one.
+    """
+    domains = [host]
+    if ":" in host:
+        domains.append(host.rsplit(":", 1)[0])
+    sites = dict((site.domain.lower(), site)
+                 for site in Site.objects.filter(domain__in=domains))
+    for domain in domains:
+        if domain in sites:
+            return sites[domain]
+    return Site.objects.get_current()
+
+
+def clear_site_cache(sender, **kwargs):
+    site_cache.clear()
+
+post_save.connect(clear_site_cache, sender=Site)
+post_delete.connect(clear_site_cache, sender=Site)
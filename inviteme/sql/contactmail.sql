@@ -0,0 +1,11 @@
+-- Run by syncdb after creating the inviteme_contact_mail table.
+-- Listing the mails of a site by date, as the admin does, uses this index.
+CREATE INDEX inviteme_contact_mail_site_id_submit_date ON inviteme_contact_mail (site_id, submit_date);
+-- Exporting the mails of a site, in chunks following the primary key, uses
+-- this index. Lookups of an email in a site use the (site_id, email) unique
+-- index.
+CREATE INDEX inviteme_contact_mail_site_id_id ON inviteme_contact_mail (site_id, id);
+-- inviteme_send_digest reads the mails not notified yet by primary key.
+CREATE INDEX inviteme_contact_mail_admin_notified_id ON inviteme_contact_mail (admin_notified, id);
+-- inviteme_send_invitations reads the mails not invited yet by primary key.
+CREATE INDEX inviteme_contact_mail_invited_date_id ON inviteme_contact_mail (invited_date, id);
@@ -0,0 +1,3 @@
+-- Run by syncdb after creating the inviteme_outbox_mail table.
+-- inviteme_send_outbox claims pending messages by next_attempt.
+CREATE INDEX inviteme_outbox_mail_status_next_attempt ON inviteme_outbox_mail (status, next_attempt);
@@ -1,30 +1,84 @@
+import time
+
 from django import template
+from django.conf import settings
 from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
 
 from inviteme.forms import ContactMailForm
 
 register = template.Library()
 
 
+INVITEME_FORM_CACHE_BUCKET = getattr(settings, "INVITEME_FORM_CACHE_BUCKET", 60)
+
+# Rendered in place of the CSRF token in cached forms.
+CSRF_TOKEN_PLACEHOLDER = "inviteme-csrf-token-placeholder"
+
+# Forms rendered in the current timestamp bucket, by (language, next).
+_form_cache = {"bucket": None, "forms": {}}
+
+
 class MailFormNode(template.Node):
+    def __init__(self, cached=False):
+        self.cached = cached
+
     def render(self, context):
+        csrf_token = context.get("csrf_token", None)
+        if self.cached and csrf_token and csrf_token != "NOTPROVIDED":
+            form_str = self.get_cached_form(context.get("next", None))
+            return mark_safe(form_str.replace(CSRF_TOKEN_PLACEHOLDER,
+                                              str(csrf_token)))
         context.push()
-        form_str = render_to_string("inviteme/form.html", 
-                                    {"form": ContactMailForm() }, 
+        form_str = render_to_string("inviteme/form.html",
+                                    {"form": ContactMailForm() },
                                     context)
         context.pop()
         return form_str
 
+    def get_cached_form(self, next):
+        """
+        Return the form rendered during the current timestamp bucket, with a
+        placeholder instead of the CSRF token. All the forms of a bucket
+        share its security timestamp, which is checked against a 2 hours
+        limit, so buckets of some minutes do not affect validation.
+        """
+        bucket = int(time.time()) // INVITEME_FORM_CACHE_BUCKET
+        if _form_cache["bucket"] != bucket:
+            _form_cache["forms"] = {}
+            _form_cache["bucket"] = bucket
+        forms = _form_cache["forms"]
+        key = (get_language(), next)
+        try:
+            return forms[key]
+        except KeyError:
+            form_str = render_to_string("inviteme/form.html",
+                                        {"form": ContactMailForm(),
+                                         "next": next,
+                                         "csrf_token": CSRF_TOKEN_PLACEHOLDER})
+            forms[key] = form_str
+            return form_str
+
 
 def render_mail_form(parser, token):
     """
-    Render the contact form (as returned by ``{% render_mail_form %}``) 
+    Render the contact form (as returned by ``{% render_mail_form %}``)
     through the ``inviteme/form.html`` template.
 
     Syntax::
 
         {% render_mail_form %}
+        {% render_mail_form cached %}
+
+    The ``cached`` form is rendered once every ``INVITEME_FORM_CACHE_BUCKET``
+    seconds, and only the CSRF token is put in on every request. The
+    template gets just the ``form``, ``next`` and ``csrf_token`` variables.
     """
-    return MailFormNode()
+    bits = token.split_contents()
+    if len(bits) > 2 or (len(bits) == 2 and bits[1] != "cached"):
+        raise template.TemplateSyntaxError(
+            "Usage: {%% %s [cached] %%}" % bits[0])
+    return MailFormNode(cached=len(bits) == 2)
 
 register.tag(render_mail_form)
@@ -25,11 +25,24 @@ def suite():
     if not os.environ.get("DJANGO_SETTINGS_MODULE", False):
         setup_django_settings()
 
-    from inviteme.tests import forms, views
+    from inviteme.tests import (cache, commands, forms, invitations, models,
+                                outbox, paginator, ratelimit, signals,
+                                signed, templatetags, utils, views)
 
     testsuite = unittest.TestSuite([
         unittest.TestLoader().loadTestsFromModule(views),
         unittest.TestLoader().loadTestsFromModule(forms),
+        unittest.TestLoader().loadTestsFromModule(models),
+        unittest.TestLoader().loadTestsFromModule(utils),
+        unittest.TestLoader().loadTestsFromModule(cache),
+        unittest.TestLoader().loadTestsFromModule(ratelimit),
+        unittest.TestLoader().loadTestsFromModule(outbox),
+        unittest.TestLoader().loadTestsFromModule(paginator),
+        unittest.TestLoader().loadTestsFromModule(signed),
+        unittest.TestLoader().loadTestsFromModule(signals),
+        unittest.TestLoader().loadTestsFromModule(commands),
+        unittest.TestLoader().loadTestsFromModule(invitations),
+        unittest.TestLoader().loadTestsFromModule(templatetags),
     ])
     return testsuite
 
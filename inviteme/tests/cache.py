@@ -0,0 +1,43 @@
+import time
+
+from django.test import TestCase
+
+from inviteme.cache import LRUCache
+
+
+class LRUCacheTestCase(TestCase):
+
+    def test_get_set_add_incr(self):
+        cache = LRUCache()
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.get("a", 0), 0)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertFalse(cache.add("a", 2))
+        self.assert_(cache.add("b", 2))
+        self.assertEqual(cache.incr("b", 3), 5)
+        self.assertRaises(ValueError, cache.incr, "c")
+        cache.delete("a")
+        self.assertEqual(cache.get("a"), None)
+        cache.clear()
+        self.assertEqual(cache.get("b"), None)
+
+    def test_expiration(self):
+        cache = LRUCache()
+        cache.set("a", 1, 0.05)
+        cache.set("b", 1, 60)
+        time.sleep(0.1)
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.get("b"), 1)
+        self.assert_(cache.add("a", 2))
+        self.assertEqual(cache.get("a"), 2)
+
+    def test_least_recently_used_keys_are_evicted(self):
+        cache = LRUCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
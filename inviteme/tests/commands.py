@@ -0,0 +1,400 @@
+import datetime
+import gzip
+import os
+import tempfile
+from StringIO import StringIO
+
+from django.contrib.sites.models import Site
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.utils import simplejson
+
+from inviteme import invitations, utils
+from inviteme.admin import export_csv
+from inviteme.bulk import delete_rows, iter_chunks, update_rows
+from inviteme.management.commands import inviteme_purge
+from inviteme.models import ContactMail, OutboxMail
+
+
+def create_contact_mails(count, site_id=1, **kwargs):
+    Site.objects.get_or_create(pk=site_id, defaults={
+            "domain": "site%d.example.com" % site_id, "name": "site"})
+    submit_date = kwargs.pop("submit_date", datetime.datetime(2012, 1, 1))
+    for i in range(count):
+        ContactMail.objects.create(site_id=site_id,
+                                   email="user%03d.%d@example.com" %
+                                   (i, site_id),
+                                   submit_date=submit_date, **kwargs)
+
+
+class FailingBackend(EmailBackend):
+    """Locmem backend that fails to send to user002.1@example.com."""
+
+    def send_messages(self, messages):
+        for message in messages:
+            if "user002.1@example.com" in message.to:
+                raise IOError("connection lost")
+        return super(FailingBackend, self).send_messages(messages)
+
+
+class IterChunksTestCase(TestCase):
+
+    def test_chunks(self):
+        create_contact_mails(7)
+        chunks = list(iter_chunks(ContactMail.objects.all(), ("email",), 3))
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 1])
+        emails = [row[0] for chunk in chunks for row in chunk]
+        self.assertEqual(emails, sorted(emails))
+        self.assertEqual(len(set(emails)), 7)
+
+    def test_filtered_queryset(self):
+        create_contact_mails(4, site_id=1)
+        create_contact_mails(4, site_id=2)
+        chunks = iter_chunks(ContactMail.objects.filter(site=2),
+                             ("site_id",), 3)
+        self.assertEqual([row for chunk in chunks for row in chunk],
+                         [(2,)] * 4)
+
+
+class UpdateDeleteRowsTestCase(TestCase):
+
+    def setUp(self):
+        create_contact_mails(7, site_id=1)
+        create_contact_mails(4, site_id=2)
+        self.progress = []
+
+    def test_update_rows(self):
+        invited_date = datetime.datetime(2012, 3, 1)
+        updated = update_rows(ContactMail.objects.for_site(1),
+                              {"invited_date": invited_date}, 3,
+                              progress=self.progress.append)
+        self.assertEqual(updated, 7)
+        self.assertEqual(self.progress, [3, 6, 7])
+        self.assertEqual(ContactMail.objects.filter(
+                invited_date=invited_date).count(), 7)
+        self.assertEqual(ContactMail.objects.for_site(2).filter(
+                invited_date__isnull=True).count(), 4)
+
+    def test_delete_rows(self):
+        deleted = delete_rows(ContactMail.objects.for_site(1), 3,
+                              progress=self.progress.append)
+        self.assertEqual(deleted, 7)
+        self.assertEqual(self.progress, [3, 6, 7])
+        self.assertEqual(list(ContactMail.objects.values_list(
+                    "site_id", flat=True).distinct()), [2])
+
+    def test_nothing_to_delete(self):
+        self.assertEqual(delete_rows(ContactMail.objects.for_site(3)), 0)
+
+
+class ExportCommandTestCase(TestCase):
+
+    def setUp(self):
+        create_contact_mails(5, ip_address="127.0.0.1")
+        create_contact_mails(3, site_id=2,
+                             submit_date=datetime.datetime(2012, 2, 1))
+
+    def export(self, **options):
+        stdout = StringIO()
+        call_command("inviteme_export", stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_export_csv(self):
+        lines = self.export(chunk_size=2).splitlines()
+        self.assertEqual(lines[0], "email,site_id,submit_date,ip_address")
+        self.assertEqual(len(lines), 9)
+        self.assertEqual(lines[1], "user000.1@example.com,1,"
+                                   "2012-01-01T00:00:00,127.0.0.1")
+
+    def test_export_jsonl(self):
+        lines = self.export(format="jsonl").splitlines()
+        self.assertEqual(len(lines), 8)
+        row = simplejson.loads(lines[0])
+        self.assertEqual(row["email"], "user000.1@example.com")
+        self.assertEqual(row["site_id"], 1)
+
+    def test_filters(self):
+        self.assertEqual(len(self.export(site=2).splitlines()), 4)
+        self.assertEqual(
+            len(self.export(since="2012-01-15").splitlines()), 4)
+        self.assertEqual(
+            len(self.export(until="2012-01-15").splitlines()), 6)
+
+    def test_export_gzip_to_file(self):
+        fd, path = tempfile.mkstemp(suffix=".csv.gz")
+        os.close(fd)
+        try:
+            self.export(output=path, gzip=True)
+            self.assertEqual(len(gzip.open(path).read().splitlines()), 9)
+        finally:
+            os.remove(path)
+
+    def test_admin_action(self):
+        closed = []
+        connection.close = lambda: closed.append(True)
+        try:
+            response = export_csv(None, None,
+                                  ContactMail.objects.filter(site=1))
+            self.assertEqual(closed, [])
+            self.assertEqual(response["Content-Type"], "text/csv")
+            self.assertEqual(len(response.content.splitlines()), 6)
+        finally:
+            del connection.close
+        self.assertEqual(closed, [True])
+
+
+class ImportCommandTestCase(TestCase):
+
+    def setUp(self):
+        self.paths = []
+
+    def tearDown(self):
+        for path in self.paths:
+            os.remove(path)
+
+    def write(self, suffix, data):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        self.paths.append(path)
+        if suffix.endswith(".gz"):
+            stream = gzip.open(path, "wb")
+        else:
+            stream = open(path, "wb")
+        stream.write(data)
+        stream.close()
+        return path
+
+    def import_file(self, path, **options):
+        stdout = StringIO()
+        call_command("inviteme_import", path, stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_import_csv(self):
+        create_contact_mails(1) # user000.1@example.com
+        path = self.write(".csv", "email,submit_date,ip_address\n"
+                          "alice@example.com,2012-01-01 10:00:00,10.0.0.1\n"
+                          "bob@example.com,,\n"
+                          "Alice@Example.com,,\n"
+                          "user000.1@example.com,,\n"
+                          "not an email,,\n")
+        output = self.import_file(path, batch_size=2)
+        self.assert_(output.startswith(
+                "2 imported, 2 duplicated, 1 invalid"), output)
+        alice = ContactMail.objects.get(email="alice@example.com")
+        self.assertEqual(alice.submit_date,
+                         datetime.datetime(2012, 1, 1, 10, 0))
+        self.assertEqual(alice.ip_address, "10.0.0.1")
+        self.assertEqual(alice.site_id, 1)
+        self.assert_(ContactMail.objects.get(email="bob@example.com")
+                     .submit_date is not None)
+
+    def test_import_csv_with_bad_lines(self):
+        path = self.write(".csv", "email,site_id\n"
+                          "alice@example.com,\n"
+                          "\xff\xfe@example.com,\n"
+                          "nul\x00@example.com,\n"
+                          "carol@example.com,two\n"
+                          "bob@example.com\n")
+        output = self.import_file(path, batch_size=1)
+        self.assert_(output.startswith("2 imported, 0 duplicated, 3 invalid"),
+                     output)
+        self.assertEqual(sorted(ContactMail.objects.values_list("email",
+                                                                flat=True)),
+                         ["alice@example.com", "bob@example.com"])
+
+    def test_import_jsonl_with_bad_lines(self):
+        path = self.write(".jsonl", "\n".join([
+                    '{"email": "alice@example.com"}',
+                    '{"email": "broken@example.com"',
+                    '["bob@example.com"]',
+                    '42',
+                    '{"email": 42}',
+                    '{"email": {"address": "carol@example.com"}}',
+                    '{"email": "dave@example.com", "site_id": [1]}',
+                    '{"email": "erin@example.com", "submit_date": 2012}',
+                    '{"email": "frank@example.com", "site_id": 1}']))
+        output = self.import_file(path, batch_size=1)
+        self.assert_(output.startswith("2 imported, 0 duplicated, 7 invalid"),
+                     output)
+
+    def test_import_exported_jsonl(self):
+        create_contact_mails(5)
+        stdout = StringIO()
+        call_command("inviteme_export", format="jsonl", stdout=stdout)
+        ContactMail.objects.all().delete()
+        path = self.write(".jsonl.gz", stdout.getvalue())
+        self.assert_(self.import_file(path).startswith("5 imported"))
+        self.assertEqual(ContactMail.objects.count(), 5)
+
+    def test_import_same_address_in_another_site(self):
+        create_contact_mails(1) # user000.1@example.com in site 1
+        create_contact_mails(1, site_id=2) # user000.2@example.com in site 2
+        path = self.write(".csv", "email,site_id\n"
+                          "user000.1@example.com,1\n"
+                          "user000.1@example.com,2\n"
+                          "user000.2@example.com,2\n"
+                          "user000.2@example.com,1\n"
+                          "user000.1@example.com,2\n")
+        output = self.import_file(path)
+        self.assert_(output.startswith("2 imported, 3 duplicated"), output)
+        self.assertEqual(
+            sorted(ContactMail.objects.values_list("site_id", "email")),
+            [(1, "user000.1@example.com"), (1, "user000.2@example.com"),
+             (2, "user000.1@example.com"), (2, "user000.2@example.com")])
+
+
+class SendDigestCommandTestCase(TestCase):
+
+    def setUp(self):
+        create_contact_mails(3, admin_notified=False)
+        create_contact_mails(2, site_id=2, admin_notified=False)
+        create_contact_mails(1, site_id=3)
+
+    def send_digest(self, **options):
+        call_command("inviteme_send_digest", stdout=StringIO(), **options)
+        utils.mail_dispatcher.join()
+
+    def test_one_digest_per_site(self):
+        self.send_digest(listed=2)
+        self.assertEqual(len(mail.outbox), 2)
+        bodies = sorted([(msg.subject, msg.body) for msg in mail.outbox])
+        self.assert_("3 new invitation requests" in bodies[0][0])
+        self.assert_("user000.1@example.com" in bodies[0][1])
+        self.assert_("user002.1@example.com" not in bodies[0][1])
+        self.assert_("and 1 more" in bodies[0][1])
+        self.assertEqual(mail.outbox[0].to, utils.notify_to)
+        self.assertEqual(
+            ContactMail.objects.filter(admin_notified=False).count(), 0)
+
+    def test_nothing_is_sent_twice(self):
+        self.send_digest()
+        mail.outbox = []
+        self.send_digest()
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class SendInvitationsCommandTestCase(TestCase):
+
+    def setUp(self):
+        create_contact_mails(5)
+        create_contact_mails(2, site_id=2)
+
+    def send_invitations(self, **options):
+        stdout = StringIO()
+        call_command("inviteme_send_invitations", stdout=stdout, rate=0,
+                     **options)
+        return stdout.getvalue()
+
+    def test_send_invitations(self):
+        output = self.send_invitations(chunk_size=2, site=1)
+        self.assert_(output.startswith("5 invitations sent"), output)
+        self.assertEqual(sorted([msg.to[0] for msg in mail.outbox]),
+                         ["user%03d.1@example.com" % i for i in range(5)])
+        self.assert_("http://%s/" % Site.objects.get(pk=1).domain
+                     in mail.outbox[0].body)
+        self.assertEqual(ContactMail.objects.filter(
+                invited_date__isnull=True).count(), 2)
+
+    def test_url_scheme(self):
+        scheme, utils.INVITEME_URL_SCHEME = utils.INVITEME_URL_SCHEME, "https"
+        try:
+            self.send_invitations(site=2)
+        finally:
+            utils.INVITEME_URL_SCHEME = scheme
+        self.assert_("https://site2.example.com/" in mail.outbox[0].body)
+
+    def test_invited_mails_are_skipped(self):
+        ContactMail.objects.filter(email="user000.1@example.com").update(
+            invited_date=datetime.datetime(2012, 3, 1))
+        self.assert_(self.send_invitations(dry_run=True).startswith(
+                "6 contact mails to invite"))
+        self.assert_(self.send_invitations().startswith("6 invitations sent"))
+        mail.outbox = []
+        self.assert_(self.send_invitations().startswith("0 invitations sent"))
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_failure_within_a_chunk(self):
+        # user002.1 is the first of the second chunk, user003.1 isn't sent
+        self.assertRaises(IOError, invitations.send_invitations,
+                          ContactMail.objects.for_site(1), chunk_size=2,
+                          backend="inviteme.tests.commands.FailingBackend")
+        self.assertEqual(sorted(ContactMail.objects.filter(
+                    invited_date__isnull=True).values_list("email",
+                                                           flat=True)),
+                         ["user000.2@example.com", "user001.2@example.com",
+                          "user002.1@example.com", "user003.1@example.com",
+                          "user004.1@example.com"])
+        self.assertEqual(len(mail.outbox), 2)
+        self.assert_(self.send_invitations().startswith("5 invitations sent"))
+        self.assertEqual(len(mail.outbox), 7)
+
+    def test_failure_after_the_first_message_of_a_chunk(self):
+        self.assertRaises(IOError, invitations.send_invitations,
+                          ContactMail.objects.for_site(1), chunk_size=3,
+                          backend="inviteme.tests.commands.FailingBackend")
+        # user000.1 and user001.1 were accepted, within the failed chunk
+        self.assertEqual(ContactMail.objects.for_site(1).filter(
+                invited_date__isnull=True).count(), 3)
+
+    def test_outbox_queues_and_marks_in_one_transaction(self):
+        mail_outbox, utils.INVITEME_MAIL_OUTBOX = \
+            utils.INVITEME_MAIL_OUTBOX, True
+        try:
+            self.assert_(self.send_invitations().startswith(
+                    "7 invitations sent"))
+        finally:
+            utils.INVITEME_MAIL_OUTBOX = mail_outbox
+        self.assertEqual(OutboxMail.objects.count(), 7)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(ContactMail.objects.filter(
+                invited_date__isnull=True).count(), 0)
+
+
+class PurgeCommandTestCase(TestCase):
+
+    def setUp(self):
+        old = datetime.datetime.now() - datetime.timedelta(days=40)
+        create_contact_mails(5, site_id=1, submit_date=old)
+        create_contact_mails(3, site_id=2, submit_date=old)
+        ContactMail.objects.create(site_id=1, email="new@example.com")
+        self.settings = (inviteme_purge.INVITEME_RETENTION_DAYS,
+                         inviteme_purge.INVITEME_RETENTION_DAYS_PER_SITE)
+
+    def tearDown(self):
+        (inviteme_purge.INVITEME_RETENTION_DAYS,
+         inviteme_purge.INVITEME_RETENTION_DAYS_PER_SITE) = self.settings
+
+    def purge(self, **options):
+        stdout = StringIO()
+        call_command("inviteme_purge", stdout=stdout, sleep=0, **options)
+        return stdout.getvalue()
+
+    def test_older_than(self):
+        output = self.purge(older_than=30, dry_run=True)
+        self.assert_(output.startswith("8 contact mails would be deleted"),
+                     output)
+        self.assertEqual(ContactMail.objects.count(), 9)
+        output = self.purge(older_than=30, site=2, batch_size=2)
+        self.assert_(output.startswith("3 contact mails deleted"), output)
+        self.assert_(self.purge(older_than=50).startswith("0 contact mails"))
+        self.assertEqual(ContactMail.objects.count(), 6)
+
+    def test_retention_settings(self):
+        inviteme_purge.INVITEME_RETENTION_DAYS = 30
+        inviteme_purge.INVITEME_RETENTION_DAYS_PER_SITE = {2: None}
+        self.assert_(self.purge().startswith("5 contact mails deleted"))
+        self.assertEqual(ContactMail.objects.for_site(2).count(), 3)
+        inviteme_purge.INVITEME_RETENTION_DAYS_PER_SITE = {2: 35}
+        self.assert_(self.purge(site=2).startswith("3 contact mails deleted"))
+        self.assertEqual(ContactMail.objects.get().email, "new@example.com")
+
+    def test_no_retention_policy(self):
+        inviteme_purge.INVITEME_RETENTION_DAYS = None
+        inviteme_purge.INVITEME_RETENTION_DAYS_PER_SITE = {}
+        # the command refuses to run then
+        self.assertEqual(inviteme_purge.retention_policies(), [])
+        self.assertEqual(len(inviteme_purge.retention_policies(
+                    older_than=30)), 1)
@@ -1,7 +1,10 @@
+import os
+import tempfile
 import time
 
 from django.test import TestCase
 
+from inviteme import normalize
 from inviteme.forms import ContactMailSecurityForm, ContactMailForm
 
 
@@ -62,3 +65,58 @@ class ContactMailFormTestCase(TestCase):
         data = form.get_instance_data()
         self.assert_( len(data) == 2 )
         self.assert_( email   == data['email'] )
+
+    def clean_email(self, email):
+        data = {'email': email}
+        data.update(ContactMailForm().initial)
+        form = ContactMailForm(data=data)
+        form.is_valid()
+        # cleaned_data is removed from invalid forms
+        return (getattr(form, "cleaned_data", {}).get("email"),
+                form.errors.get("email"))
+
+    def test_email_is_normalized(self):
+        self.assertEqual(self.clean_email(" Alice.Liddell@WonderLand.com "),
+                         (EMAIL_ADDR, None))
+        self.assertEqual(self.clean_email(u"alice@b\xfccher.ch"),
+                         (u"alice@xn--bcher-kva.ch", None))
+
+    def test_blocked_domains(self):
+        blocked_domains = normalize.blocked_domains
+        normalize.blocked_domains = normalize.load_blocked_domains(
+            ["Mailinator.com"])
+        try:
+            email, errors = self.clean_email("alice@mailinator.com")
+            self.assert_(errors)
+            email, errors = self.clean_email("alice@eu.MAILINATOR.com")
+            self.assert_(errors)
+            email, errors = self.clean_email("alice@notmailinator.com")
+            self.assertEqual(errors, None)
+        finally:
+            normalize.blocked_domains = blocked_domains
+
+
+class NormalizeEmailTestCase(TestCase):
+
+    def test_normalize_email(self):
+        self.assertEqual(normalize.normalize_email("Alice+News@Example.COM.",
+                                                   strip_plus_tags=True),
+                         "alice@example.com")
+        self.assertEqual(normalize.normalize_email("Alice+News@Example.COM",
+                                                   lowercase=False,
+                                                   strip_plus_tags=False),
+                         "Alice+News@example.com")
+        for email in ("alice", "@example.com", "alice@", "alice@a..com"):
+            self.assertRaises(ValueError, normalize.normalize_email, email)
+
+    def test_load_blocked_domains_file(self):
+        path = tempfile.mktemp()
+        blocked_file = open(path, "w")
+        blocked_file.write("# disposable\n\nMailinator.com\nb\xc3\xbccher.ch\n")
+        blocked_file.close()
+        try:
+            self.assertEqual(normalize.load_blocked_domains(["spam.com"], path),
+                             frozenset(["spam.com", "mailinator.com",
+                                        "xn--bcher-kva.ch"]))
+        finally:
+            os.remove(path)
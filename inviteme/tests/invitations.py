@@ -0,0 +1,26 @@
+from django.test import TestCase
+
+from inviteme.invitations import Throttle
+
+
+class ThrottleTestCase(TestCase):
+
+    def test_throttle(self):
+        now = [100.0]
+        sleeps = []
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+        throttle = Throttle(4, clock=lambda: now[0], sleep=sleep)
+        for i in range(3):
+            throttle.wait()
+        self.assertEqual(sleeps, [0.25, 0.25])
+        now[0] += 10 # idle time is not made up for with a burst
+        throttle.wait()
+        throttle.wait()
+        self.assertEqual(sleeps, [0.25, 0.25, 0.25])
+
+    def test_no_rate_does_not_wait(self):
+        throttle = Throttle(None, sleep=lambda seconds: self.fail("slept"))
+        throttle.wait()
+        throttle.wait()
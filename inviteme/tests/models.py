@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from inviteme.models import ContactMail
+
+
+class Rollback(Exception):
+    pass
+
+
+class CreateUniqueTestCase(TransactionTestCase):
+
+    def create(self, email):
+        return ContactMail.objects.create_unique(site_id=settings.SITE_ID,
+                                                 email=email)
+
+    def test_create_unique(self):
+        self.assert_(self.create("alice@example.com") is not None)
+        self.assert_(self.create("alice@example.com") is None)
+        self.assertEqual(ContactMail.objects.count(), 1)
+
+    def test_duplicate_keeps_the_work_of_the_caller(self):
+        self.create("alice@example.com")
+        @transaction.commit_on_success
+        def work():
+            ContactMail.objects.create(site_id=settings.SITE_ID,
+                                       email="bob@example.com")
+            self.assert_(self.create("alice@example.com") is None)
+        work()
+        self.assertEqual(ContactMail.objects.filter(
+                email="bob@example.com").count(), 1)
+
+    def test_insert_is_not_committed_before_the_caller(self):
+        @transaction.commit_on_success
+        def work():
+            ContactMail.objects.create(site_id=settings.SITE_ID,
+                                       email="bob@example.com")
+            self.assert_(self.create("alice@example.com") is not None)
+            raise Rollback
+        self.assertRaises(Rollback, work)
+        self.assertEqual(ContactMail.objects.count(), 0)
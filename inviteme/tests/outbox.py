@@ -0,0 +1,95 @@
+import datetime
+from StringIO import StringIO
+
+from django.conf import settings
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.test import TestCase
+
+from inviteme import utils
+from inviteme.models import OutboxMail
+
+
+class FailingBackend(EmailBackend):
+
+    def send_messages(self, messages):
+        raise IOError("Connection refused")
+
+
+class OutboxMailTestCase(TestCase):
+
+    def setUp(self):
+        self.outbox_setting = utils.INVITEME_MAIL_OUTBOX
+        utils.INVITEME_MAIL_OUTBOX = True
+
+    def tearDown(self):
+        utils.INVITEME_MAIL_OUTBOX = self.outbox_setting
+
+    def send_outbox(self, **options):
+        options.setdefault("verbosity", 0)
+        call_command("inviteme_send_outbox", stdout=StringIO(), **options)
+
+    def test_send_mail_stores_message_in_outbox(self):
+        utils.send_mail("subject", "body", "from@example.com",
+                        ["alice@example.com", "bob@example.com"],
+                        html="<p>body</p>")
+        self.assertEqual(len(mail.outbox), 0)
+        outbox_mail = OutboxMail.objects.get()
+        self.assertEqual(outbox_mail.status, OutboxMail.PENDING)
+        self.assertEqual(outbox_mail.get_recipients(),
+                         ["alice@example.com", "bob@example.com"])
+        self.assertEqual(outbox_mail.html, "<p>body</p>")
+
+    def test_command_sends_pending_messages(self):
+        for i in range(5):
+            utils.send_mail("subject", "body", "from@example.com",
+                            ["user%d@example.com" % i])
+        self.send_outbox(batch_size=2)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(
+            OutboxMail.objects.filter(status=OutboxMail.SENT).count(), 5)
+
+    def test_claimed_messages_are_not_claimed_again(self):
+        for i in range(3):
+            utils.send_mail("subject", "body", "from@example.com",
+                            ["user%d@example.com" % i])
+        first = OutboxMail.objects.claim(2, "worker-1")
+        second = OutboxMail.objects.claim(2, "worker-2")
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.failIf(set(m.pk for m in first) & set(m.pk for m in second))
+
+    def test_stale_claims_are_released(self):
+        utils.send_mail("subject", "body", "from@example.com",
+                        ["alice@example.com"])
+        OutboxMail.objects.claim(1, "worker-1")
+        OutboxMail.objects.update(claimed_date=datetime.datetime.now() -
+                                  datetime.timedelta(seconds=700))
+        self.send_outbox(stale=600)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failed_messages_are_retried_with_backoff(self):
+        utils.send_mail("subject", "body", "from@example.com",
+                        ["alice@example.com"])
+        email_backend = settings.EMAIL_BACKEND
+        settings.EMAIL_BACKEND = "inviteme.tests.outbox.FailingBackend"
+        try:
+            self.send_outbox(backoff=60, max_attempts=2)
+            outbox_mail = OutboxMail.objects.get()
+            self.assertEqual(outbox_mail.status, OutboxMail.PENDING)
+            self.assertEqual(outbox_mail.attempts, 1)
+            self.assert_("Connection refused" in outbox_mail.last_error)
+            self.assert_(outbox_mail.next_attempt >
+                         datetime.datetime.now() +
+                         datetime.timedelta(seconds=50))
+            # not due yet
+            self.send_outbox(max_attempts=2)
+            self.assertEqual(OutboxMail.objects.get().attempts, 1)
+            OutboxMail.objects.update(next_attempt=datetime.datetime.now())
+            self.send_outbox(max_attempts=2)
+            self.assertEqual(OutboxMail.objects.get().status,
+                             OutboxMail.FAILED)
+        finally:
+            settings.EMAIL_BACKEND = email_backend
+        self.assertEqual(len(mail.outbox), 0)
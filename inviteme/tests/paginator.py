@@ -0,0 +1,71 @@
+import datetime
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from inviteme.admin import date_range_params
+from inviteme.models import ContactMail
+from inviteme.paginator import EstimatedCountPaginator, estimated_count
+
+
+class EstimatedCountPaginatorTestCase(TransactionTestCase):
+    # ANALYZE commits the transaction TestCase would roll back.
+
+    def setUp(self):
+        for i in range(30):
+            ContactMail.objects.create(site_id=1,
+                                       email="user%d@example.com" % i)
+        connection.cursor().execute("ANALYZE")
+        self.threshold = EstimatedCountPaginator.threshold
+
+    def tearDown(self):
+        EstimatedCountPaginator.threshold = self.threshold
+        ContactMail.objects.all().delete()
+
+    def test_estimated_count(self):
+        self.assertEqual(estimated_count(ContactMail.objects.all()), 30)
+
+    def test_paginator(self):
+        EstimatedCountPaginator.threshold = 10
+        ContactMail.objects.create(site_id=1, email="alice@example.com")
+        # statistics are not up to date
+        paginator = EstimatedCountPaginator(ContactMail.objects.all(), 10)
+        self.assertEqual(paginator.count, 30)
+        # filtered querysets are counted
+        paginator = EstimatedCountPaginator(
+            ContactMail.objects.filter(site=1), 10)
+        self.assertEqual(paginator.count, 31)
+
+    def test_paginator_under_threshold_or_disabled(self):
+        ContactMail.objects.create(site_id=1, email="alice@example.com")
+        for threshold in (100, None):
+            EstimatedCountPaginator.threshold = threshold
+            paginator = EstimatedCountPaginator(ContactMail.objects.all(), 10)
+            self.assertEqual(paginator.count, 31)
+
+
+class DateRangeParamsTestCase(TestCase):
+
+    def test_date_hierarchy_lookups(self):
+        self.assertEqual(
+            date_range_params({"submit_date__year": "2011"}, "submit_date"),
+            {"submit_date__gte": datetime.date(2011, 1, 1),
+             "submit_date__lt": datetime.date(2012, 1, 1)})
+        self.assertEqual(
+            date_range_params({"submit_date__year": "2011",
+                               "submit_date__month": "12", "q": "x"},
+                              "submit_date"),
+            {"submit_date__gte": datetime.date(2011, 12, 1),
+             "submit_date__lt": datetime.date(2012, 1, 1), "q": "x"})
+        self.assertEqual(
+            date_range_params({"submit_date__year": "2012",
+                               "submit_date__month": "2",
+                               "submit_date__day": "29"}, "submit_date"),
+            {"submit_date__gte": datetime.date(2012, 2, 29),
+             "submit_date__lt": datetime.date(2012, 3, 1)})
+
+    def test_other_params_are_kept(self):
+        for params in ({}, {"submit_date__year": "x"},
+                       {"submit_date__year": "2011",
+                        "submit_date__month": "13"}):
+            self.assertEqual(date_range_params(params, "submit_date"), params)
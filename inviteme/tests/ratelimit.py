@@ -0,0 +1,26 @@
+from django.test import TestCase
+
+from inviteme.cache import LRUCache
+from inviteme.ratelimit import RateLimit
+
+
+class RateLimitTestCase(TestCase):
+
+    def test_limit_per_window(self):
+        rate_limit = RateLimit(LRUCache(), 2, 60, "test")
+        self.assert_(rate_limit.hit("a", now=600))
+        self.assert_(rate_limit.hit("a", now=610))
+        self.assertFalse(rate_limit.hit("a", now=620))
+        self.assert_(rate_limit.hit("b", now=620))
+
+    def test_previous_window_counts_while_overlapped(self):
+        rate_limit = RateLimit(LRUCache(), 2, 60, "test")
+        rate_limit.hit("a", now=650)
+        rate_limit.hit("a", now=655)
+        # 15 seconds into the next window, 3/4 of the previous one count
+        self.assertFalse(rate_limit.hit("a", now=675))
+        rate_limit = RateLimit(LRUCache(), 2, 60, "test")
+        rate_limit.hit("a", now=650)
+        rate_limit.hit("a", now=655)
+        # 45 seconds into it, only 1/4
+        self.assert_(rate_limit.hit("a", now=705))
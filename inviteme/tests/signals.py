@@ -0,0 +1,74 @@
+import gc
+
+from django.test import TestCase
+
+from inviteme import metrics
+from inviteme.signals import VetoableSignal
+
+
+class VetoableSignalTestCase(TestCase):
+
+    def setUp(self):
+        self.signal = VetoableSignal(providing_args=["data"], name="test")
+        self.calls = []
+
+    def receiver(self, name, response=None):
+        def receiver(sender, **kwargs):
+            self.calls.append(name)
+            return response
+        receiver.__name__ = name
+        return receiver
+
+    def test_receivers_are_called_by_priority(self):
+        receivers = [self.receiver("slow"), self.receiver("cheap"),
+                     self.receiver("default")]
+        self.signal.connect(receivers[0], priority=10)
+        self.signal.connect(receivers[1], priority=-10)
+        self.signal.connect(receivers[2])
+        self.signal.send_vetoable(sender=None, data={})
+        self.assertEqual(self.calls, ["cheap", "default", "slow"])
+
+    def test_reconnected_receivers_lose_their_priority(self):
+        receivers = [self.receiver("slow"), self.receiver("default")]
+        self.signal.connect(receivers[0], priority=10)
+        self.signal.connect(receivers[1])
+        self.signal.disconnect(receivers[0])
+        self.assertEqual(self.signal.priorities, {
+            self.signal.lookup_key(receivers[1], None, None): 0})
+        self.signal.connect(receivers[0], priority=-10)
+        self.signal.send_vetoable(sender=None, data={})
+        self.assertEqual(self.calls, ["slow", "default"])
+
+    def test_collected_receivers_lose_their_priority(self):
+        receivers = [self.receiver("collected"), self.receiver("default")]
+        self.signal.connect(receivers[0], priority=10)
+        self.signal.connect(receivers[1])
+        del receivers[0]
+        gc.collect()
+        self.assertEqual(self.signal.priorities, {
+            self.signal.lookup_key(receivers[0], None, None): 0})
+
+    def test_first_veto_stops_the_dispatch(self):
+        receivers = [self.receiver("ban_list", False),
+                     self.receiver("spam_check")]
+        self.signal.connect(receivers[1], priority=10)
+        self.signal.connect(receivers[0])
+        responses = self.signal.send_vetoable(sender=None, data={})
+        self.assertEqual(self.calls, ["ban_list"])
+        self.assertEqual(responses, [(receivers[0], False)])
+        # send() still calls every receiver
+        self.signal.send(sender=None, data={})
+        self.assertEqual(self.calls, ["ban_list", "ban_list", "spam_check"])
+
+    def test_receivers_are_timed(self):
+        receiver = self.receiver("ban_list")
+        self.signal.connect(receiver)
+        stages = []
+        timing_callback = metrics.timing_callback
+        metrics.timing_callback = lambda stage, seconds: stages.append(stage)
+        try:
+            self.signal.send_vetoable(sender=None, data={})
+        finally:
+            metrics.timing_callback = timing_callback
+        self.assertEqual(stages,
+                         ["receivers.test.inviteme.tests.signals.ban_list"])
@@ -0,0 +1,100 @@
+import datetime
+import hmac
+
+from django.conf import settings
+from django.test import TestCase
+from django.utils import crypto
+from django.utils.hashcompat import sha_constructor
+
+from inviteme import signed
+from inviteme.forms import ContactMailForm
+
+
+DATA = {'email': u'alice.liddell@wonderland.com',
+        'submit_date': datetime.datetime(2012, 1, 30, 17, 45, 3)}
+
+
+class MailTokenTestCase(TestCase):
+
+    def test_dumps_mail_and_loads_mail(self):
+        key = signed.dumps_mail(DATA, extra_key="salt")
+        self.assert_(key.startswith(signed.MAIL_TOKEN_PREFIX))
+        self.assertEqual(signed.loads_mail(key, extra_key="salt"), DATA)
+
+    def test_non_ascii_email(self):
+        data = dict(DATA, email=u'al\xefce@wonderland.com')
+        key = signed.dumps_mail(data)
+        self.assertEqual(signed.loads_mail(unicode(key))['email'],
+                         data['email'])
+
+    def test_submit_date_is_kept_in_seconds(self):
+        data = dict(DATA, submit_date=DATA['submit_date'].replace(
+                microsecond=123456))
+        key = signed.dumps_mail(data)
+        self.assertEqual(signed.loads_mail(key)['submit_date'],
+                         DATA['submit_date'])
+
+    def test_token_is_shorter_than_pickle(self):
+        self.assert_(len(signed.dumps_mail(DATA)) <
+                     len(signed.dumps(DATA, compress=True)))
+
+    def test_bad_signature(self):
+        key = signed.dumps_mail(DATA, extra_key="salt")
+        self.assertRaises(signed.BadSignature, signed.loads_mail, key)
+        self.assertRaises(signed.BadSignature, signed.loads_mail,
+                          key[:-1], extra_key="salt")
+        value = signed.MAIL_TOKEN_PREFIX + "AAA"
+        self.assertRaises(signed.BadSignature, signed.loads_mail,
+                          signed.sign(value, "key"), key="key")
+
+    def test_legacy_tokens_are_accepted(self):
+        key = signed.dumps(DATA, compress=True, extra_key="salt")
+        self.assertEqual(signed.loads_mail(key, extra_key="salt"), DATA)
+
+
+class SigningKeysTestCase(TestCase):
+
+    def setUp(self):
+        self.secret_key = settings.SECRET_KEY
+        self.fallbacks = getattr(settings, 'INVITEME_SECRET_KEY_FALLBACKS', ())
+
+    def tearDown(self):
+        settings.SECRET_KEY = self.secret_key
+        settings.INVITEME_SECRET_KEY_FALLBACKS = self.fallbacks
+
+    def test_salted_hmac_matches_django(self):
+        self.assertEqual(
+            signed.salted_hmac("salt", "value").hexdigest(),
+            crypto.salted_hmac("salt", "value").hexdigest())
+        # the cached HMAC object is not modified
+        self.assertEqual(
+            signed.salted_hmac("salt", "other").hexdigest(),
+            crypto.salted_hmac("salt", "other").hexdigest())
+
+    def test_base64_hmac_matches_hmac(self):
+        for value in ("one", "two"):
+            self.assertEqual(
+                signed.base64_hmac(value, "key"),
+                signed.encode(hmac.new("key", value, sha_constructor).digest()))
+
+    def test_old_secrets_are_accepted(self):
+        old_key = signed.dumps_mail(DATA, extra_key="salt")
+        settings.SECRET_KEY = "new secret"
+        self.assertRaises(signed.BadSignature, signed.loads_mail, old_key,
+                          extra_key="salt")
+        settings.INVITEME_SECRET_KEY_FALLBACKS = [self.secret_key]
+        self.assertEqual(signed.loads_mail(old_key, extra_key="salt"), DATA)
+        # new tokens are signed with the new secret
+        new_key = signed.dumps_mail(DATA, extra_key="salt")
+        self.assertNotEqual(new_key, old_key)
+        settings.INVITEME_SECRET_KEY_FALLBACKS = []
+        self.assertEqual(signed.loads_mail(new_key, extra_key="salt"), DATA)
+
+    def test_security_hash_with_old_secret_is_accepted(self):
+        form = ContactMailForm()
+        data = {"email": "alice@example.com"}
+        data.update(form.initial)
+        settings.SECRET_KEY = "new secret"
+        self.assert_("security_hash" in ContactMailForm(data=data).errors)
+        settings.INVITEME_SECRET_KEY_FALLBACKS = [self.secret_key]
+        self.assert_(ContactMailForm(data=data).is_valid())
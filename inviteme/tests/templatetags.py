@@ -0,0 +1,42 @@
+from django.template import Context, Template, TemplateSyntaxError
+from django.test import TestCase
+
+from inviteme.templatetags import inviteme_tags
+
+
+class RenderMailFormTestCase(TestCase):
+
+    def setUp(self):
+        inviteme_tags._form_cache["bucket"] = None
+
+    def render(self, tag, **context):
+        return Template("{%% load inviteme_tags %%}{%% %s %%}" % tag).render(
+            Context(context))
+
+    def test_render_mail_form(self):
+        output = self.render("render_mail_form", csrf_token="abc123")
+        self.assert_('name="email"' in output)
+        self.assert_("value='abc123'" in output)
+
+    def test_cached_form_is_rendered_once_per_bucket(self):
+        first = self.render("render_mail_form cached", csrf_token="abc123")
+        second = self.render("render_mail_form cached", csrf_token="xyz789")
+        self.assert_("value='abc123'" in first)
+        self.assert_("value='xyz789'" in second)
+        self.assertEqual(first.replace("abc123", "xyz789"), second)
+        self.failIf(inviteme_tags.CSRF_TOKEN_PLACEHOLDER in second)
+
+    def test_cached_form_changes_with_the_bucket(self):
+        inviteme_tags._form_cache["bucket"] = -1
+        inviteme_tags._form_cache["forms"] = {("en-us", None): "stale"}
+        output = self.render("render_mail_form cached", csrf_token="abc123")
+        self.assert_('name="email"' in output)
+        self.assertNotEqual(inviteme_tags._form_cache["bucket"], -1)
+
+    def test_cached_form_without_csrf_token_is_not_cached(self):
+        self.render("render_mail_form cached")
+        self.assertEqual(inviteme_tags._form_cache["bucket"], None)
+
+    def test_bad_syntax(self):
+        self.assertRaises(TemplateSyntaxError, self.render,
+                          "render_mail_form uncached")
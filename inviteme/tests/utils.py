@@ -0,0 +1,238 @@
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase
+
+from inviteme import utils
+from inviteme.metrics import MailMetrics, Timer, null_timer
+from inviteme import metrics
+from inviteme.utils import MailDispatcher, MailQueueFull, parse_recipients
+
+
+class BlockingBackend(EmailBackend):
+    """Locmem backend that holds messages with subject "block" until the
+    test releases them."""
+    release = None
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.subject == "block":
+                self.release.wait()
+        return super(BlockingBackend, self).send_messages(messages)
+
+
+class CountingBackend(EmailBackend):
+    """Locmem backend that keeps track of opened and closed connections."""
+    opened = 0
+    closed = 0
+
+    def open(self):
+        CountingBackend.opened += 1
+
+    def close(self):
+        CountingBackend.closed += 1
+
+
+class MailDispatcherTestCase(TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        BlockingBackend.release = self.release
+
+    def tearDown(self):
+        self.release.set()
+
+    def message(self, subject="subject"):
+        return EmailMessage(subject, "body", "from@example.com",
+                            ["to@example.com"])
+
+    def blocking_dispatcher(self, overflow):
+        # one worker busy, with a batch of one message, and the queue full
+        dispatcher = MailDispatcher(workers=1, queue_size=1, batch_size=1,
+                                    overflow=overflow,
+                            backend="inviteme.tests.utils.BlockingBackend")
+        dispatcher.submit(self.message("block"))
+        while not dispatcher.queue.empty():
+            time.sleep(0.001)
+        dispatcher.submit(self.message("block"))
+        return dispatcher
+
+    def test_messages_are_sent_by_fixed_workers(self):
+        dispatcher = MailDispatcher(workers=2, queue_size=10)
+        before = threading.activeCount()
+        for i in range(20):
+            dispatcher.submit(self.message())
+        self.assertEqual(threading.activeCount(), before + 2)
+        dispatcher.join()
+        self.assertEqual(len(mail.outbox), 20)
+        dispatcher.stop()
+
+    def test_overflow_drop(self):
+        dispatcher = self.blocking_dispatcher("drop")
+        self.assertFalse(dispatcher.submit(self.message()))
+        self.release.set()
+        dispatcher.join()
+        self.assertEqual(len(mail.outbox), 2)
+        dispatcher.stop()
+
+    def test_overflow_send(self):
+        dispatcher = self.blocking_dispatcher("send")
+        self.assert_(dispatcher.submit(self.message()))
+        self.assertEqual(len(mail.outbox), 1) # sent by the caller
+        self.release.set()
+        dispatcher.join()
+        self.assertEqual(len(mail.outbox), 3)
+        dispatcher.stop()
+
+    def test_overflow_raise(self):
+        dispatcher = self.blocking_dispatcher("raise")
+        self.assertRaises(MailQueueFull, dispatcher.submit, self.message())
+        self.release.set()
+        dispatcher.stop()
+
+    def test_stop_drains_the_queue(self):
+        dispatcher = MailDispatcher(workers=1, queue_size=100)
+        for i in range(10):
+            dispatcher.submit(self.message())
+        dispatcher.stop()
+        self.assertEqual(len(mail.outbox), 10)
+        self.failIf(dispatcher.is_running())
+
+    def test_connection_is_reused_across_batches(self):
+        CountingBackend.opened = CountingBackend.closed = 0
+        dispatcher = MailDispatcher(workers=1, batch_size=3, idle=60,
+                            backend="inviteme.tests.utils.CountingBackend")
+        for i in range(10):
+            dispatcher.queue.put((self.message(), False))
+        dispatcher.start()
+        dispatcher.join()
+        self.assertEqual(len(mail.outbox), 10)
+        self.assertEqual(CountingBackend.opened, 1)
+        self.assertEqual(CountingBackend.closed, 0)
+        dispatcher.stop()
+        self.assertEqual(CountingBackend.closed, 1)
+
+    def test_idle_connection_is_closed(self):
+        CountingBackend.opened = CountingBackend.closed = 0
+        dispatcher = MailDispatcher(workers=1, idle=0.01,
+                            backend="inviteme.tests.utils.CountingBackend")
+        dispatcher.submit(self.message())
+        dispatcher.join()
+        time.sleep(0.1)
+        self.assertEqual(CountingBackend.closed, 1)
+        dispatcher.submit(self.message())
+        dispatcher.join()
+        self.assertEqual(CountingBackend.opened, 2)
+        dispatcher.stop()
+
+
+class MailMetricsTestCase(TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.metrics = MailMetrics(hook=lambda *args: self.events.append(args))
+
+    def test_counters_and_hook(self):
+        dispatcher = MailDispatcher(workers=1, metrics=self.metrics)
+        for i in range(3):
+            dispatcher.submit(EmailMessage("subject", "body",
+                                           "from@example.com",
+                                           ["to@example.com"]))
+        dispatcher.join()
+        stats = dispatcher.stats()
+        self.assertEqual(stats["queued"], 3)
+        self.assertEqual(stats["sent"], 3)
+        self.assertEqual(stats["failed"], 0)
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertEqual(sum(count for bound, count in stats["latency"]), 3)
+        self.assertEqual(len([e for e in self.events if e[0] == "sent"]), 3)
+        dispatcher.stop()
+
+    def test_failing_hook_does_not_stop_the_workers(self):
+        def hook(event, value):
+            raise socket.error("statsd is down")
+        dispatcher = MailDispatcher(workers=1, metrics=MailMetrics(hook))
+        for i in range(3):
+            dispatcher.submit(EmailMessage("subject", "body",
+                                           "from@example.com",
+                                           ["to@example.com"]))
+        dispatcher.join()
+        self.assertEqual(dispatcher.stats()["sent"], 3)
+        self.assert_(dispatcher.is_running())
+        dispatcher.stop()
+
+    def test_latency_histogram(self):
+        self.metrics.observe_latency(0.003)
+        self.metrics.observe_latency(0.2)
+        self.metrics.observe_latency(60)
+        latency = dict(self.metrics.snapshot()["latency"])
+        self.assertEqual(latency[0.01], 1)
+        self.assertEqual(latency[0.25], 1)
+        self.assertEqual(latency[None], 1)
+
+
+class TimerTestCase(TestCase):
+
+    def test_stages(self):
+        calls = []
+        timer = Timer(lambda stage, seconds: calls.append((stage, seconds)),
+                      "view")
+        time.sleep(0.01)
+        timer.mark("first")
+        timer.mark("second")
+        timer.total()
+        self.assertEqual([stage for stage, seconds in calls],
+                         ["view.first", "view.second", "view.total"])
+        self.assert_(calls[0][1] >= 0.01)
+        self.assert_(calls[1][1] < 0.01)
+        self.assert_(calls[2][1] >= calls[0][1] + calls[1][1])
+
+    def test_no_timer_without_callback(self):
+        timing_callback = metrics.timing_callback
+        metrics.timing_callback = None
+        try:
+            self.assert_(metrics.start_timer("view") is null_timer)
+        finally:
+            metrics.timing_callback = timing_callback
+
+
+class GetTemplateTestCase(TestCase):
+
+    def setUp(self):
+        self.debug = settings.DEBUG
+        utils._template_cache.clear()
+
+    def tearDown(self):
+        settings.DEBUG = self.debug
+        utils._template_cache.clear()
+
+    def test_templates_are_cached(self):
+        settings.DEBUG = False
+        template = utils.get_template("inviteme/confirmation_email.txt")
+        self.assert_(template is
+                     utils.get_template("inviteme/confirmation_email.txt"))
+
+    def test_templates_are_not_cached_with_debug(self):
+        settings.DEBUG = True
+        template = utils.get_template("inviteme/confirmation_email.txt")
+        self.failIf(template is
+                    utils.get_template("inviteme/confirmation_email.txt"))
+
+
+class ParseRecipientsTestCase(TestCase):
+
+    def test_parse_recipients(self):
+        admins = (("Joe", "joe@example.com"),)
+        self.assertEqual(parse_recipients("a@example.com, B <b@example.com>,",
+                                          admins),
+                         ["a@example.com", "B <b@example.com>"])
+        self.assertEqual(parse_recipients(["a@example.com"], admins),
+                         ["a@example.com"])
+        self.assertEqual(parse_recipients("", admins),
+                         ["Joe <joe@example.com>"])
+        self.assertEqual(parse_recipients(None), [])
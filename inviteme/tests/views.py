@@ -2,14 +2,18 @@ import re
 import threading
 
 from django.conf import settings
+from django.contrib.sites.models import Site
 from django.core import mail
 from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.test.client import RequestFactory
 
-from inviteme import signals, signed
+from inviteme import metrics, ratelimit, signals, signed, sites, utils, views
+from inviteme.dedupe import recent_requests
 from inviteme.models import ContactMail
+from inviteme.replay import used_keys
 from inviteme.views import INVITEME_SALT
-from inviteme.utils import mail_sent_queue
+from inviteme.utils import mail_dispatcher
 
 
 class GetFormViewTestCase(TestCase):
@@ -33,6 +37,12 @@ class PostFormViewTestCase(TestCase):
                 self.timestamp = form.initial["timestamp"]
                 self.security_hash = form.initial["security_hash"]
 
+    def tearDown(self):
+        # don't let mails sent by this test end up in another test's outbox
+        mail_dispatcher.join()
+        ratelimit.email_rate_limit.store.clear()
+        recent_requests.store.clear()
+
     def post_valid_data(self):
         data = {'timestamp':     self.timestamp,
                 'security_hash': self.security_hash,
@@ -70,6 +80,7 @@ class PostFormViewTestCase(TestCase):
     def test_confirmation_email_is_sent(self):
         self.assertEqual(len(mail.outbox), 0)
         self.post_valid_data() # self.response gets updated
+        mail_dispatcher.join()
         self.assertEqual(len(mail.outbox), 1)
 
     def test_signal_confirmation_requested_is_sent(self):
@@ -86,6 +97,95 @@ class PostFormViewTestCase(TestCase):
         self.assertTemplateUsed(self.response, 
                                 "inviteme/confirmation_sent.html")
 
+    def test_confirmations_per_email_are_limited(self):
+        limit = ratelimit.email_rate_limit.limit
+        window, recent_requests.window = recent_requests.window, 0
+        try:
+            for i in range(limit):
+                self.post_valid_data()
+                self.assertEqual(self.response.status_code, 200)
+            self.post_valid_data()
+        finally:
+            recent_requests.window = window
+        self.assertEqual(self.response.status_code, 429)
+        self.assertTemplateUsed(self.response, "inviteme/rate_limited.html")
+        mail_dispatcher.join()
+        self.assertEqual(len(mail.outbox), limit)
+
+    def test_stages_are_timed(self):
+        stages = []
+        timing_callback = metrics.timing_callback
+        metrics.timing_callback = lambda stage, seconds: stages.append(stage)
+        try:
+            self.post_valid_data()
+        finally:
+            metrics.timing_callback = timing_callback
+        self.assertEqual(stages, [
+                "post_form.ip_rate_limit", "post_form.validate",
+                "post_form.email_rate_limit",
+                "post_form.confirmation_will_be_requested", "post_form.sign",
+                "post_form.render", "post_form.handoff",
+                "post_form.confirmation_requested", "post_form.response",
+                "post_form.total"])
+
+    def test_duplicated_posts_send_one_confirmation(self):
+        self.post_valid_data()
+        self.post_valid_data()
+        self.assertTemplateUsed(self.response,
+                                "inviteme/confirmation_sent.html")
+        mail_dispatcher.join()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_discarded_posts_are_not_deduplicated(self):
+        def on_signal(sender, data, request, **kwargs):
+            return False
+
+        signals.confirmation_will_be_requested.connect(on_signal)
+        try:
+            self.post_valid_data()
+        finally:
+            signals.confirmation_will_be_requested.disconnect(on_signal)
+        self.post_valid_data()
+        mail_dispatcher.join()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failed_sends_are_not_deduplicated(self):
+        send_templated_mail = views.send_templated_mail
+        def dropped(*args, **kwargs):
+            return False
+        def queue_full(*args, **kwargs):
+            raise utils.MailQueueFull("full")
+        for fail in (dropped, queue_full):
+            views.send_templated_mail = fail
+            try:
+                try:
+                    self.post_valid_data()
+                except utils.MailQueueFull:
+                    pass
+            finally:
+                views.send_templated_mail = send_templated_mail
+        self.post_valid_data()
+        mail_dispatcher.join()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_dedupe_keys_are_valid_memcached_keys(self):
+        key = recent_requests.cache_key(u"\xf1" * 300 + u" \n@example.com", 1)
+        self.assert_(len(key) < 250)
+        self.assertFalse(re.search(r"[\s\x00-\x1f\x7f]", key))
+
+    def test_posts_per_ip_are_limited(self):
+        ip_rate_limit = views.ip_rate_limit
+        views.ip_rate_limit = ratelimit.RateLimit(
+            ratelimit.email_rate_limit.store, 1, 60, "ip")
+        try:
+            self.post_valid_data()
+            self.assertEqual(self.response.status_code, 200)
+            # rejected before the form is even validated
+            response = self.client.post(reverse("inviteme-post-form"), data={})
+            self.assertEqual(response.status_code, 429)
+        finally:
+            views.ip_rate_limit = ip_rate_limit
+
 
 class ConfirmMailViewTestCase(TestCase):
 
@@ -101,10 +201,15 @@ class ConfirmMailViewTestCase(TestCase):
                 'email':         'alice.bloggs@example.com'}
         self.response = self.client.post(
             reverse("inviteme-post-form"), data=data)        
-        if mail_sent_queue.get(block=True):
-            pass
+        mail_dispatcher.join()
         self.url = re.search(r'http://[\S]+', mail.outbox[0].body).group()
 
+    def tearDown(self):
+        mail_dispatcher.join()
+        used_keys.store.clear()
+        ratelimit.email_rate_limit.store.clear()
+        recent_requests.store.clear()
+
     def get_confirm_mail_url(self, key):
         self.response = self.client.get(reverse("inviteme-confirm-mail",
                                                 kwargs={'key': key}))
@@ -124,6 +229,35 @@ class ConfirmMailViewTestCase(TestCase):
         self.get_confirm_mail_url(key)
         self.assertContains(self.response, "404", status_code=404)
 
+    def test_stages_are_timed(self):
+        stages = []
+        timing_callback = metrics.timing_callback
+        metrics.timing_callback = lambda stage, seconds: stages.append(stage)
+        try:
+            self.get_confirm_mail_url(self.url.split("/")[-1])
+        finally:
+            metrics.timing_callback = timing_callback
+        self.assertEqual(stages, [
+                "confirm_mail.used_keys", "confirm_mail.verify",
+                "confirm_mail.registered",
+                "confirm_mail.confirmation_received", "confirm_mail.insert",
+                "confirm_mail.render", "confirm_mail.handoff",
+                "confirm_mail.response", "confirm_mail.total"])
+
+    def test_used_keys_are_refused_without_loading_them(self):
+        key = self.url.split("/")[-1]
+        self.get_confirm_mail_url(key)
+        self.assertEqual(self.response.status_code, 200)
+        loads_mail = signed.loads_mail
+        def fail(*args, **kwargs):
+            self.fail("loads_mail called for a used key")
+        signed.loads_mail = fail
+        try:
+            self.get_confirm_mail_url(key)
+        finally:
+            signed.loads_mail = loads_mail
+        self.assertContains(self.response, "404", status_code=404)
+
     def test_signal_receiver_avoids_mailing_admins(self):
         # test that receivers of signal confirmation_received may return False
         # and thus rendering a template_discarded uotput
@@ -134,6 +268,7 @@ class ConfirmMailViewTestCase(TestCase):
         signals.confirmation_received.connect(on_signal)
         key = self.url.split("/")[-1]
         self.get_confirm_mail_url(key)
+        mail_dispatcher.join()
         self.assertEqual(len(mail.outbox), 1) # mailing avoided by on_signal
         self.assertTemplateUsed(self.response, 
                                 "inviteme/discarded.html")
@@ -141,7 +276,8 @@ class ConfirmMailViewTestCase(TestCase):
     def test_contact_msg_is_created_and_email_sent(self):
         key = self.url.split("/")[-1]
         self.get_confirm_mail_url(key)
-        data = signed.loads(key, extra_key=INVITEME_SALT)
+        mail_dispatcher.join()
+        data = signed.loads_mail(key, extra_key=INVITEME_SALT)
         try:
             cmail = ContactMail.objects.get(email=data["email"], 
                                             submit_date=data["submit_date"])
@@ -152,8 +288,128 @@ class ConfirmMailViewTestCase(TestCase):
         # CONTACTME_NOTIFY_TO, otherwise there won't be 2 mails
         self.assertEqual(len(mail.outbox), 2)
 
+    def test_digest_mode_leaves_the_admins_for_the_digest(self):
+        notify_digest, utils.INVITEME_NOTIFY_DIGEST = \
+            utils.INVITEME_NOTIFY_DIGEST, True
+        try:
+            self.get_confirm_mail_url(self.url.split("/")[-1])
+        finally:
+            utils.INVITEME_NOTIFY_DIGEST = notify_digest
+        mail_dispatcher.join()
+        self.assertEqual(len(mail.outbox), 1) # only the confirmation request
+        self.assertFalse(ContactMail.objects.get().admin_notified)
+
     def test_user_is_told_about_contact_msg_received(self):
         key = self.url.split("/")[-1]
         self.get_confirm_mail_url(key)
         self.assertTemplateUsed(self.response, 
                                 "inviteme/accepted.html")
+
+    def test_concurrent_confirmations_create_one_contact_mail(self):
+        # A second visit to the URL arrives while the first one is between
+        # the confirmation_received signal and the INSERT, as it would do
+        # from a concurrent request.
+        key = self.url.split("/")[-1]
+        url = reverse("inviteme-confirm-mail", kwargs={'key': key})
+        responses = []
+        def on_signal(sender, data, request, **kwargs):
+            if not responses:
+                responses.append(None)
+                responses.append(self.client.get(url))
+
+        signals.confirmation_received.connect(on_signal)
+        try:
+            responses.append(self.client.get(url))
+        finally:
+            signals.confirmation_received.disconnect(on_signal)
+        self.assertEqual([r.status_code for r in responses[1:]], [200, 404])
+        self.assertEqual(ContactMail.objects.count(), 1)
+
+    def test_receivers_are_not_called_for_registered_addresses(self):
+        calls = []
+        def on_signal(sender, data, request, **kwargs):
+            calls.append(data["email"])
+        key = self.url.split("/")[-1]
+        data = signed.loads_mail(key, extra_key=INVITEME_SALT)
+        # confirmed already with another key
+        ContactMail.objects.create(site_id=settings.SITE_ID,
+                                   email=data["email"])
+        signals.confirmation_received.connect(on_signal)
+        try:
+            self.get_confirm_mail_url(key)
+        finally:
+            signals.confirmation_received.disconnect(on_signal)
+        self.assertEqual(self.response.status_code, 404)
+        self.assertEqual(calls, [])
+
+    def test_confirming_an_address_already_registered_fails(self):
+        # a newer URL for the same address doesn't produce a server error
+        key = self.url.split("/")[-1]
+        data = signed.loads_mail(key, extra_key=INVITEME_SALT)
+        ContactMail.objects.create(site_id=settings.SITE_ID,
+                                   email=data["email"])
+        self.get_confirm_mail_url(key)
+        self.assertContains(self.response, "404", status_code=404)
+
+
+class MultiSiteTestCase(TestCase):
+
+    def setUp(self):
+        self.site_from_host = sites.INVITEME_SITE_FROM_HOST
+        sites.INVITEME_SITE_FROM_HOST = True
+        self.other = Site.objects.create(domain="other.example.com",
+                                         name="Other")
+
+    def tearDown(self):
+        sites.INVITEME_SITE_FROM_HOST = self.site_from_host
+        sites.site_cache.clear()
+        mail_dispatcher.join()
+        used_keys.store.clear()
+        ratelimit.email_rate_limit.store.clear()
+        recent_requests.store.clear()
+
+    def confirm(self, host, email="alice.bloggs@example.com"):
+        response = self.client.get(reverse("inviteme-get-form"),
+                                   HTTP_HOST=host)
+        form = response.context["form"]
+        data = {'timestamp':     form.initial["timestamp"],
+                'security_hash': form.initial["security_hash"],
+                'email':         email}
+        mail_dispatcher.join()
+        mail.outbox = []
+        self.client.post(reverse("inviteme-post-form"), data=data,
+                         HTTP_HOST=host)
+        mail_dispatcher.join()
+        self.url = re.search(r'http://[\S]+', mail.outbox[0].body).group()
+        key = self.url.split("/")[-1]
+        return self.client.get(reverse("inviteme-confirm-mail",
+                                       kwargs={'key': key}), HTTP_HOST=host)
+
+    def test_address_is_registered_once_per_site(self):
+        self.assertEqual(self.confirm("other.example.com").status_code, 200)
+        self.assert_(self.url.startswith("http://other.example.com/"))
+        # keys are only valid in the site they were requested in
+        response = self.client.get(self.url.split("example.com")[-1],
+                                   HTTP_HOST="example.com")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.confirm("example.com").status_code, 200)
+        self.assertEqual(
+            ContactMail.objects.for_site(self.other).get().email,
+            "alice.bloggs@example.com")
+        self.assertEqual(
+            ContactMail.objects.for_site(settings.SITE_ID).count(), 1)
+
+    def test_unknown_host_gets_the_default_site(self):
+        self.assertEqual(self.confirm("unknown.example.com").status_code,
+                         200)
+        self.assertEqual(ContactMail.objects.get().site_id, settings.SITE_ID)
+
+    def test_sites_are_looked_up_once_per_host(self):
+        request = RequestFactory().get("/",
+                                       HTTP_HOST="other.example.com:8000")
+        self.assertEqual(sites.get_site(request), self.other)
+        self.assertNumQueries(0, sites.get_site, request)
+        # saving a site clears the cache
+        self.other.domain = "renamed.example.com"
+        self.other.save()
+        self.assertEqual(sites.get_site(request).pk, settings.SITE_ID)
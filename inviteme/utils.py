@@ -1,33 +1,357 @@
 # borrowed from Selwin Ong:
 # http://ui.co.id/blog/asynchronous-send_mail-in-django
+#
+# Rather than starting a thread per message, messages are queued and sent by
+# a fixed pool of long-lived worker threads (see MailDispatcher).
 
+import atexit
+import logging
+import os
 import Queue
 import threading
+import time
 
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template import loader
+from django.utils.log import NullHandler
 
+from inviteme.metrics import mail_metrics, null_timer
+from inviteme.models import OutboxMail
 
-mail_sent_queue = Queue.Queue()
 
+INVITEME_MAIL_WORKERS = getattr(settings, "INVITEME_MAIL_WORKERS", 2)
+INVITEME_MAIL_QUEUE_SIZE = getattr(settings, "INVITEME_MAIL_QUEUE_SIZE", 1000)
+INVITEME_MAIL_QUEUE_OVERFLOW = getattr(settings,
+                                       "INVITEME_MAIL_QUEUE_OVERFLOW", "block")
+INVITEME_MAIL_BATCH_SIZE = getattr(settings, "INVITEME_MAIL_BATCH_SIZE", 20)
+INVITEME_MAIL_BATCH_LINGER = getattr(settings, "INVITEME_MAIL_BATCH_LINGER", 0)
+INVITEME_MAIL_CONNECTION_IDLE = getattr(settings,
+                                        "INVITEME_MAIL_CONNECTION_IDLE", 30)
+INVITEME_MAIL_OUTBOX = getattr(settings, "INVITEME_MAIL_OUTBOX", False)
+INVITEME_NOTIFY_DIGEST = getattr(settings, "INVITEME_NOTIFY_DIGEST", False)
+# Scheme of the links to the site in the emails.
+INVITEME_URL_SCHEME = getattr(settings, "INVITEME_URL_SCHEME", "http")
 
-class EmailThread(threading.Thread):
-    def __init__(self, subject, body, from_email, recipient_list, fail_silently, html):
-        self.subject = subject
-        self.body = body
-        self.recipient_list = recipient_list
-        self.from_email = from_email
-        self.fail_silently = fail_silently
-        self.html = html
-        threading.Thread.__init__(self)
 
-    def run (self):
-        msg = EmailMultiAlternatives(self.subject, self.body, self.from_email, self.recipient_list)
-        if self.html:
-            msg.attach_alternative(self.html, "text/html")
-        msg.send(self.fail_silently)
-        mail_sent_queue.put(True)
+logger = logging.getLogger("inviteme.mail")
+logger.addHandler(NullHandler())
+
+
+class MailQueueFull(Exception):
+    """Raised by MailDispatcher.submit when the queue is full and the
+    overflow policy is ``raise``."""
+    pass
+
+
+# Placed in the queue once per worker to make it exit.
+_STOP = object()
+
+
+class MailDispatcher(object):
+    """
+    Sends email messages from a fixed number of long-lived worker threads.
+
+    Messages are put in a bounded queue, so the number of threads and the
+    memory used stay flat no matter how many messages are submitted. When the
+    queue is full the ``overflow`` policy decides what to do:
+
+    * ``block``: wait until there is room in the queue (the default).
+    * ``send``: send the message in the calling thread.
+    * ``drop``: discard the message.
+    * ``raise``: raise ``MailQueueFull``.
+
+    Each worker takes up to ``batch_size`` messages from the queue at once,
+    waiting at most ``linger`` seconds for the batch to fill, and sends them
+    through one connection to the mail backend. The connection is kept open
+    for the next batch and closed after ``idle`` seconds without messages.
+
+    Workers are started with the first submitted message. Calling ``stop``
+    sends all the messages still in the queue before the workers exit.
+
+    Deliveries are recorded in ``metrics``, a ``MailMetrics`` instance.
+    """
+    OVERFLOW_POLICIES = ("block", "send", "drop", "raise")
+
+    def __init__(self, workers=2, queue_size=1000, overflow="block",
+                 batch_size=20, linger=0, idle=30, backend=None,
+                 metrics=mail_metrics):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: %r" % overflow)
+        self.workers = max(1, int(workers))
+        self.overflow = overflow
+        self.batch_size = max(1, int(batch_size))
+        self.linger = linger
+        self.idle = idle
+        self.backend = backend
+        self.metrics = metrics
+        self.queue = Queue.Queue(max(0, int(queue_size)))
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker threads, unless they are already running."""
+        self._lock.acquire()
+        try:
+            # Threads do not survive a fork, start new ones in the child.
+            if self._threads and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = []
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work,
+                                          name="inviteme-mail-%d" % index)
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+
+    def is_running(self):
+        return bool(self._threads) and self._pid == os.getpid()
+
+    def submit(self, message, fail_silently=False):
+        """
+        Queue an ``EmailMessage`` to be sent by the workers. Returns False if the message has been dropped.
+        """
+        if not self.is_running():
+            self.start()
+        item = (message, fail_silently)
+        if self.overflow == "block":
+            self.queue.put(item)
+            self.metrics.incr("queued")
+            return True
+        try:
+            self.queue.put_nowait(item)
+        except Queue.Full:
+            if self.overflow == "send":
+                self._close(self.deliver([item]))
+            elif self.overflow == "drop":
+                logger.warning("Mail queue full, message to %s dropped",
+                               ", ".join(message.recipients()))
+                self.metrics.incr("dropped")
+                return False
+            else:
+                raise MailQueueFull("Mail queue full (%d messages)" %
+                                    self.queue.maxsize)
+        else:
+            self.metrics.incr("queued")
+        return True
+
+    def deliver(self, items, connection=None):
+        """
+        Send a list of ``(message, fail_silently)`` pairs through a single
+        connection to the mail backend, opening one if ``connection`` is None.
+        Returns the connection, still open so that it can be reused, or None.
+
+        Messages are handed to the connection one at a time so that a failure
+        is attributed to its message and never causes the rest of the batch
+        to be sent twice. A reused connection may have been closed by the
+        server in the meantime; messages failing on it are retried once on a
+        new connection.
+        """
+        for message, fail_silently in items:
+            reused = connection is not None
+            while True:
+                try:
+                    if connection is None:
+                        connection = get_connection(self.backend)
+                        connection.open()
+                    start = time.time()
+                    connection.send_messages([message])
+                except Exception:
+                    connection = self._close(connection)
+                    if reused:
+                        reused = False
+                        continue
+                    self.metrics.incr("failed")
+                    if not fail_silently:
+                        logger.exception("Error sending mail to %s",
+                                         ", ".join(message.recipients()))
+                else:
+                    self.metrics.observe_latency(time.time() - start)
+                    self.metrics.incr("sent")
+                break
+        return connection
+
+    def stats(self):
+        """Return the metrics snapshot plus the current ``queue_depth``."""
+        stats = self.metrics.snapshot()
+        stats["queue_depth"] = self.queue.qsize()
+        return stats
+
+    def join(self):
+        """
+        Block until every message submitted so far has been handled. Tests use
+        it to wait for the mail sent by a view to reach ``mail.outbox``.
+        """
+        if self.is_running():
+            self.queue.join()
+
+    def stop(self, timeout=None):
+        """
+        Send the messages still in the queue and stop the workers. Waits at
+        most ``timeout`` seconds for each worker to finish.
+        """
+        self._lock.acquire()
+        try:
+            if not self.is_running():
+                return
+            threads, self._threads = self._threads, []
+            for thread in threads:
+                self.queue.put((_STOP, None))
+        finally:
+            self._lock.release()
+        for thread in threads:
+            thread.join(timeout)
+
+    def _next_batch(self, timeout):
+        """
+        Return a list with the next items in the queue, or None if the queue
+        stays empty for ``timeout`` seconds. A stop item ends the batch.
+        """
+        try:
+            batch = [self.queue.get(timeout is not None, timeout)]
+        except Queue.Empty:
+            return None
+        deadline = time.time() + self.linger
+        while batch[-1][0] is not _STOP and len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(True, remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+    def _close(self, connection):
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        return None
+
+    def _work(self):
+        connection = None
+        while True:
+            # Only time out waiting when there is a connection to close.
+            batch = self._next_batch(connection and self.idle)
+            if batch is None:
+                connection = self._close(connection)
+                continue
+            stop = batch[-1][0] is _STOP
+            if stop:
+                batch.pop()
+            try:
+                connection = self.deliver(batch, connection)
+            finally:
+                for item in batch:
+                    self.queue.task_done()
+            if stop:
+                self._close(connection)
+                self.queue.task_done()
+                return
+
+
+mail_dispatcher = MailDispatcher(workers=INVITEME_MAIL_WORKERS,
+                                 queue_size=INVITEME_MAIL_QUEUE_SIZE,
+                                 overflow=INVITEME_MAIL_QUEUE_OVERFLOW,
+                                 batch_size=INVITEME_MAIL_BATCH_SIZE,
+                                 linger=INVITEME_MAIL_BATCH_LINGER,
+                                 idle=INVITEME_MAIL_CONNECTION_IDLE)
+
+# Drain the queue when the interpreter exits.
+atexit.register(mail_dispatcher.stop)
+
+
+def build_message(subject, body, from_email, recipient_list, html=None):
+    msg = EmailMultiAlternatives(subject, body, from_email, recipient_list)
+    if html:
+        msg.attach_alternative(html, "text/html")
+    return msg
+
+
+def send_message(msg, fail_silently=False):
+    if INVITEME_MAIL_OUTBOX:
+        OutboxMail.objects.enqueue(msg)
+        mail_metrics.incr("queued")
+        return True
+    return mail_dispatcher.submit(msg, fail_silently)
 
 
 def send_mail(subject, body, from_email, recipient_list, fail_silently=False, html=None):
-    EmailThread(subject, body, from_email, recipient_list, fail_silently, html).start()
+    return send_message(build_message(subject, body, from_email,
+                                      recipient_list, html), fail_silently)
+
+
+def render_mail(subject, template, context, from_email, recipient_list,
+                html_template=None):
+    """
+    Return a message whose body is ``template`` rendered with ``context``,
+    with ``html_template`` rendered as its HTML alternative, if given.
+    """
+    body = get_template(template).render(context)
+    html = None
+    if html_template:
+        html = get_template(html_template).render(context)
+    return build_message(subject, body, from_email, recipient_list, html)
+
+
+def send_templated_mail(subject, template, context, from_email,
+                        recipient_list, fail_silently=False,
+                        html_template=None, timer=null_timer):
+    """
+    Like ``send_mail``, with the body rendered from templates.
+
+    The ``render`` and ``handoff`` stages are marked in ``timer``.
+    """
+    msg = render_mail(subject, template, context, from_email, recipient_list,
+                      html_template)
+    timer.mark("render")
+    sent = send_message(msg, fail_silently)
+    timer.mark("handoff")
+    return sent
+
+
+def parse_recipients(notify_to, admins=()):
+    """
+    Return the list of addresses in ``notify_to``, a comma separated string
+    or a sequence, or the ``admins`` ones if it is empty.
+    """
+    if isinstance(notify_to, basestring):
+        notify_to = notify_to.split(",")
+    recipients = [addr.strip() for addr in notify_to or () if addr.strip()]
+    if not recipients:
+        recipients = ["%s <%s>" % (name, email) for name, email in admins]
+    return recipients
+
+
+# Who is notified of the confirmed requests, parsed once per process.
+notify_to = parse_recipients(getattr(settings, "INVITEME_NOTIFY_TO", None),
+                             settings.ADMINS)
+
+
+_template_cache = {}
+
+
+def get_template(template_name):
+    """
+    Return the compiled template ``template_name``, loading it only once per
+    process. With ``DEBUG`` on templates are loaded on every call, so that
+    changes to the files show up without restarting.
+
+    Compiled templates are shared between threads. That is safe for the
+    email templates, whose tags keep no render state.
+    """
+    if settings.DEBUG:
+        return loader.get_template(template_name)
+    try:
+        return _template_cache[template_name]
+    except KeyError:
+        template = loader.get_template(template_name)
+        _template_cache[template_name] = template
+        return template
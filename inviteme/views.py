@@ -3,7 +3,7 @@ from django.contrib.sites.models import Site
 from django.core.urlresolvers import reverse
 from django.http import HttpResponseRedirect, HttpResponseBadRequest, Http404
 from django.shortcuts import render_to_response
-from django.template import loader, Context, RequestContext
+from django.template import Context, RequestContext
 from django.template.loader import render_to_string
 from django.views.decorators.csrf import csrf_protect
 from django.views.decorators.http import require_GET, require_POST
@@ -11,7 +11,13 @@ from django.utils.html import escape
 from django.utils.translation import ugettext_lazy as _
 
 from inviteme import signals, signed
-from inviteme.utils import send_mail
+from inviteme.dedupe import recent_requests
+from inviteme.ratelimit import email_rate_limit, ip_rate_limit
+from inviteme.metrics import mail_metrics, null_timer, start_timer
+from inviteme.replay import used_keys
+from inviteme.sites import get_site
+from inviteme import utils
+from inviteme.utils import send_templated_mail
 from inviteme.models import ContactMail
 from inviteme.forms import ContactMailForm
 
@@ -32,43 +38,53 @@ class ContactMailPostBadRequest(HttpResponseBadRequest):
             self.content = render_to_string("inviteme/400-debug.html", {"why": why})
 
 
-def send_confirmation_email(data, key, text_template="inviteme/confirmation_email.txt", html_template="inviteme/confirmation_email.html"):
+def confirmation_salt(site):
     """
-    Render message and send contact_mail confirmation email
+    Salt of the confirmation keys of ``site``, so that a key is only valid
+    in the site it was requested in. The ``SITE_ID`` site keeps the plain
+    ``INVITEME_SALT``, with which keys were signed before sites were told
+    apart.
     """
-    site = Site.objects.get_current()
+    if site.id == settings.SITE_ID:
+        return INVITEME_SALT
+    return "%s:%d" % (INVITEME_SALT, site.id)
+
+
+def send_confirmation_email(data, key, text_template="inviteme/confirmation_email.txt", html_template="inviteme/confirmation_email.html", timer=null_timer, site=None):
+    """
+    Render message and send contact_mail confirmation email. Returns False
+    if the message has been dropped by the mail dispatcher.
+    """
+    if site is None:
+        site = Site.objects.get_current()
     subject = "[%s] %s" % (site.name, _("confirm invitation request"))
     confirmation_url = reverse("inviteme-confirm-mail", args=[key])
     message_context = Context({ 'data': data,
                                 'confirmation_url': confirmation_url,
                                 'support_email': DEFAULT_FROM_EMAIL,
-                                'site': site })
-
-    # prepare text message
-    text_message_template = loader.get_template(text_template)
-    text_message = text_message_template.render(message_context)
-    # prepare html message
-    html_message_template = loader.get_template(html_template)
-    html_message = html_message_template.render(message_context)
+                                'site': site,
+                                'scheme': utils.INVITEME_URL_SCHEME })
 
-    send_mail(subject, text_message, DEFAULT_FROM_EMAIL, [data['email'],], html=html_message)
+    # text message with an html alternative
+    return send_templated_mail(subject, text_template, message_context,
+                               DEFAULT_FROM_EMAIL, [data['email'],],
+                               html_template=html_template, timer=timer)
 
 
-def send_request_received_email(contact_mail, template="inviteme/request_received_email.txt"):
-    site = Site.objects.get_current()
+def send_request_received_email(contact_mail, template="inviteme/request_received_email.txt", timer=null_timer):
+    site = contact_mail.site
     subject = "[%s] %s" % (site.name, _("new invitation request"))
-    message_template = loader.get_template(template)
     message_context = Context({ 'contact_mail': contact_mail, 'site': site })
-    message = message_template.render(message_context)
-    if getattr(settings, "INVITEME_NOTIFY_TO", False):
-        if len(settings.INVITEME_NOTIFY_TO.split(",")) > 0:
-            notify_to = settings.INVITEME_NOTIFY_TO.split(",")
-        else:
-            notify_to = [settings.INVITEME_NOTIFY_TO]
-    else:
-        notify_to = ["%s <%s>" % (name, email) 
-                     for name, email in settings.ADMINS ]
-    send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, notify_to)
+    send_templated_mail(subject, template, message_context,
+                        settings.DEFAULT_FROM_EMAIL, utils.notify_to,
+                        timer=timer)
+
+
+def rate_limited(request, template):
+    response = render_to_response(template,
+                                  context_instance=RequestContext(request))
+    response.status_code = 429
+    return response
 
 
 @require_GET
@@ -78,13 +94,24 @@ def get_form(request, next=None, template="inviteme/inviteme.html"):
 
 @csrf_protect
 @require_POST
-def post_form(request, next=None, template_preview="inviteme/preview.html", template_discarded="inviteme/discarded.html", template_post="inviteme/confirmation_sent.html"):
+def post_form(request, next=None, template_preview="inviteme/preview.html", template_discarded="inviteme/discarded.html", template_post="inviteme/confirmation_sent.html", template_limited="inviteme/rate_limited.html"):
     """
     Post the mail form.
 
     HTTP POST is required. If ``POST['submit'] == "preview"`` or if there are
     errors a preview template, ``comments/preview.html``, will be rendered.
+    Clients posting more often than allowed by ``INVITEME_RATE_LIMIT_PER_IP``
+    or asking for more confirmations of an address than allowed by
+    ``INVITEME_RATE_LIMIT_PER_EMAIL`` get a 429 response.
+
+    The time taken by each stage is passed to ``INVITEME_TIMING_CALLBACK``.
     """
+    timer = start_timer("post_form")
+    if ip_rate_limit and not ip_rate_limit.hit(
+            request.META.get("REMOTE_ADDR", "")):
+        return rate_limited(request, template_limited)
+    timer.mark("ip_rate_limit")
+
     data = request.POST.copy()
 
     # Check to see if the POST data overrides the view's next argument.
@@ -104,52 +131,95 @@ def post_form(request, next=None, template_preview="inviteme/preview.html", temp
         return render_to_response(template_preview, 
                                   {"form": form, "next": next}, 
                                   RequestContext(request, {}))
+    timer.mark("validate")
 
     contact_mail_data = form.get_instance_data()
+    email = contact_mail_data["email"]
+    site = get_site(request)
+    # A confirmation message has just been sent to this address, answer as
+    # if it had been sent again
+    if not recent_requests.add(email, site.id):
+        mail_metrics.incr("deduplicated")
+        return confirmation_sent(request, next, template_post)
+
+    if email_rate_limit and not email_rate_limit.hit(email.lower()):
+        recent_requests.discard(email, site.id)
+        return rate_limited(request, template_limited)
+    timer.mark("email_rate_limit")
+
     # Signal that a confirmation is about to be requested
-    responses = signals.confirmation_will_be_requested.send(
+    responses = signals.confirmation_will_be_requested.send_vetoable(
         sender=form.__class__, data=contact_mail_data, request=request)
 
     # Check whether a signal receiver decides to kill the process
     for (receiver, response) in responses:
         if response == False:
+            recent_requests.discard(email, site.id)
             return render_to_response(template_discarded, 
                                       {'data': contact_mail_data},
                                       context_instance=RequestContext(request))
 
+    timer.mark("confirmation_will_be_requested")
+
     # Create key and send confirmation URL by email
-    key = signed.dumps(contact_mail_data, compress=True, 
-                       extra_key=INVITEME_SALT)
-    send_confirmation_email(contact_mail_data, key)
+    key = signed.dumps_mail(contact_mail_data,
+                            extra_key=confirmation_salt(site))
+    timer.mark("sign")
+    # Let the user ask again right away if the message couldn't be queued
+    try:
+        sent = send_confirmation_email(contact_mail_data, key, timer=timer,
+                                       site=site)
+    except:
+        recent_requests.discard(email, site.id)
+        raise
+    if sent is False:
+        recent_requests.discard(email, site.id)
     
     # Signal that a confirmation has been requested
     signals.confirmation_requested.send(sender=form.__class__, 
                                         data=contact_mail_data, 
                                         request=request)
+    timer.mark("confirmation_requested")
+
+    response = confirmation_sent(request, next, template_post)
+    timer.mark("response")
+    timer.total()
+    return response
+
 
+def confirmation_sent(request, next, template):
     if next is not None:
         return HttpResponseRedirect(next)
 
-    return render_to_response(template_post, 
+    return render_to_response(template, 
                               context_instance=RequestContext(request))
 
 
 def confirm_mail(request, key, template_accepted="inviteme/accepted.html", template_discarded="inviteme/discarded.html"):
+    timer = start_timer("confirm_mail")
+    # Refuse URLs already visited before doing any work
+    if key in used_keys:
+        raise Http404
+    timer.mark("used_keys")
+    site = get_site(request)
     try:
-        data = signed.loads(key, extra_key=INVITEME_SALT)
+        data = signed.loads_mail(key, extra_key=confirmation_salt(site))
     except (ValueError, signed.BadSignature):
         raise Http404
-    
-    # Check that the URL is not confirmed yet otherwise return a Http404
-    exists = (ContactMail.objects.filter(
-            email=data['email'], submit_date=data['submit_date']).count() > 0)
-    if exists:
+    timer.mark("verify")
+
+    # Addresses already registered in the site, i.e. confirmed with another
+    # key, don't reach the receivers of confirmation_received
+    if ContactMail.objects.for_site(site).filter(
+            email=data['email']).exists():
         raise Http404
+    timer.mark("registered")
 
     # Signal that the contact_message is about to be saved
-    responses = signals.confirmation_received.send(sender  = ContactMail,
-                                                   data    = data,
-                                                   request = request
+    responses = signals.confirmation_received.send_vetoable(
+        sender  = ContactMail,
+        data    = data,
+        request = request
     )
 
     # Check whether a signal receiver decides to discard the contact_msg
@@ -157,19 +227,33 @@ def confirm_mail(request, key, template_accepted="inviteme/accepted.html", templ
         if response == False:
             return render_to_response(template_discarded, {'data': data},
                                       context_instance=RequestContext(request))
+    timer.mark("confirmation_received")
 
     # Create ContactMail object
     # - note: The submit_date read in the key may be used as well to discard 
     #         messages older than a certain date. Read the docs for an example.
     #         http://readthedocs.org/projects/django-inviteme
-    contact_mail = ContactMail.objects.create(site_id    = settings.SITE_ID,
-                                             email       = data['email'], 
-                                             submit_date = data['submit_date'])
-    contact_mail.ip_address = request.META.get("REMOTE_ADDR", None)
-    contact_mail.save()
-
-    # Notify Admins about the new ContactMsg
-    send_request_received_email(contact_mail)
-
-    return render_to_response(template_accepted, {'data':data}, 
-                              context_instance=RequestContext(request))
+    # - note: A single INSERT both creates the object and detects whether the
+    #         URL has been confirmed already ((site, email) is unique). The
+    #         check above lets two concurrent visits to the same URL pass.
+    contact_mail = ContactMail.objects.create_unique(
+        site        = site,
+        email       = data['email'],
+        submit_date = data['submit_date'],
+        ip_address  = request.META.get("REMOTE_ADDR", None),
+        admin_notified = not utils.INVITEME_NOTIFY_DIGEST)
+    used_keys.add(key, data['submit_date'])
+    if contact_mail is None:
+        raise Http404
+    timer.mark("insert")
+
+    # Notify Admins about the new ContactMsg, unless it waits for the next
+    # digest (see the inviteme_send_digest command)
+    if contact_mail.admin_notified:
+        send_request_received_email(contact_mail, timer=timer)
+
+    response = render_to_response(template_accepted, {'data':data}, 
+                                  context_instance=RequestContext(request))
+    timer.mark("response")
+    timer.total()
+    return response